@@ -1,14 +1,116 @@
-import pandas as pd
-import seaborn as sns
-import matplotlib.pyplot as plt
-import matplotlib.patches as mpatches
-import logging, requests, csv, re, os, zipfile
-from datetime import datetime, timedelta
+# pandas, seaborn, matplotlib and requests are imported by the functions that use them,
+# so stages that don't need them (e.g. fetch and bundle don't plot) start fast
+import logging, sys, csv, re, os, zipfile, hashlib, json, shutil, time, tempfile, argparse, contextlib, multiprocessing, io, sqlite3, threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from datetime import date, datetime, timedelta, timezone
 
 
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# HTTP settings for the report service
+API_BASE_URL = "https://dash.adjust.com/control-center/reports-service/csv_report"
+REQUEST_TIMEOUT = (5, 120)  # (connect, read) seconds per request
+MAX_RETRIES = 4  # Retries on 429/5xx and connection errors
+BACKOFF_FACTOR = 1  # Exponential backoff: 1s, 2s, 4s, ... between retries
+BACKOFF_MAX = 30  # Upper bound in seconds for a single backoff
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+POOL_SIZE = 8  # Keep-alive connections shared by concurrent report requests
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024  # Bytes written to disk per chunk while a report streams in
+CSV_CHUNK_ROWS = 100_000  # Rows parsed per chunk when loading a report
+
+# Rate metrics can't be summed: they are recombined weighted by another metric
+RATE_METRICS = {'organic_install_rate': 'installs'}
+
+# Columns loaded from reports and their dtypes; other columns the service sends are skipped.
+# Counts that stay far below 4.29 billion per row are unsigned 32-bit. Sessions, events, clicks
+# and impressions of a large account can pass that, and the CSV parser wraps overflowing values
+# silently, so they stay 64-bit. Dimensions repeat on every row and are categorical.
+REPORT_SCHEMA = {
+    'month': 'str',
+    'channel': 'category',
+    'installs': 'uint32',
+    'reattributions': 'uint32',
+    'rejected_installs': 'uint32',
+    'rejected_reattributions': 'uint32',
+    'maus': 'uint32',
+    'revenue_events': 'uint32',
+    'sessions': 'int64',
+    'events': 'int64',
+    'clicks': 'int64',
+    'impressions': 'int64',
+    'organic_install_rate': 'float32',
+}
+
+# Local report cache: closed past months never change, the open month still does
+CACHE_DIR = os.environ.get('AUTOQBR_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'autoqbr'))
+CACHE_TTL_CLOSED = 30 * 24 * 3600  # Seconds a report that ends before the current month stays valid
+CACHE_TTL_OPEN = 15 * 60  # Seconds a report that touches the current month stays valid
+CACHE_MAX_BYTES = 512 * 1024 * 1024  # Least recently used reports are evicted above this size
+
+# Rendered charts are cached under a hash of their input, spec, style and drawing code,
+# so unchanged charts are copied instead of rendered again (None disables, --no-chart-cache)
+CHART_CACHE_DIR = os.path.join(CACHE_DIR, 'charts')
+CHART_CACHE_MAX_BYTES = 128 * 1024 * 1024  # Least recently used charts are evicted above this size
+
+# Large app token lists are split into shards fetched in parallel and merged
+APP_TOKEN_SHARD_SIZE = 50  # App tokens per request
+FAILED_SHARD = "Failed request, shard excluded from report"  # Audit trail header for shards that failed
+
+# Long date ranges are fetched as concurrent month-aligned chunks
+LONG_RANGE_MONTHS = 3  # Ranges spanning more months than this are split into monthly chunks
+CHUNK_CONCURRENCY = 4  # Chunks of one report in flight at once
+CHUNK_RETRIES = 2  # Extra rounds for chunks that failed, the others are kept
+
+# Monthly history store: closed months are fetched once and merged from here on later runs
+HISTORY_DB = os.environ.get('AUTOQBR_HISTORY_DB', os.path.join(CACHE_DIR, 'history.sqlite3'))
+HISTORY_SETTLE_DAYS = 3  # Days after a month ends (in the report's timezone) before it's stored as final
+
+# Reports fetched for every QBR: (dimensions, metrics, output filename)
+REPORTS = [
+    ('month', 'installs,reattributions,sessions,rejected_installs,rejected_reattributions,organic_install_rate,maus,clicks,impressions,events,revenue_events', 'data_by_month.csv'),
+    ('channel', 'installs,reattributions,sessions,rejected_installs,rejected_reattributions', 'data_by_channel.csv'),
+]
+UTC_OFFSET_PATTERN = r"^[+-]\d{2}:00$"
+
+# Top-N breakdowns: charts of the largest values of a metric by any dimensions
+BREAKDOWN_TOP_N = 5  # Bars per breakdown chart
+ORGANIC_DIMENSIONS = ('channel', 'network')  # Dimensions whose values name organic traffic
+OTHER_LABEL = 'Other'  # Label of the bar rolling up everything outside the top N
+
+# ZIP bundle: artifacts are archived as they are produced, already compressed formats are stored as they are
+ZIP_COMPRESS_LEVEL = 6  # Deflate level of text artifacts, 0 (fastest) to 9 (smallest) (--compress-level)
+STORED_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.zip', '.gz')  # Not worth compressing again
+
+# Batch mode settings
+BATCH_WORKERS = os.cpu_count() or 1  # QBR jobs run in parallel, one per process
+BATCH_API_CONCURRENCY = 4  # Report requests in flight at once across all batch jobs
+
+# Shared by batch worker processes to bound concurrent requests against the API
+_api_slots = None
+
+# Service mode settings: a local HTTP endpoint in front of a pool of warm worker processes
+SERVICE_HOST = '127.0.0.1'  # Only clients on this host, e.g. the portal
+SERVICE_PORT = 8642
+SERVICE_WORKERS = os.cpu_count() or 1  # QBRs generated at once, one worker process each
+SERVICE_QUEUE_SIZE = 16  # QBR requests waiting for a worker; more are turned away with 503
+SERVICE_RETRY_AFTER = 5  # Seconds a turned away client is asked to wait
+
+# Kept open by each service worker, so reports reuse its connections across QBRs
+_service_session = None
+
+# Instrumentation: every pipeline step is recorded as a span and bundled as metrics.csv
+METRICS_FILE = 'metrics.csv'
+METRICS_FIELDS = ['stage', 'span', 'wall_seconds', 'cpu_seconds', 'peak_rss_mb', 'rss_growth_mb', 'details']
+METRICS_STDOUT = False  # Also print the spans of a run when it is bundled (--metrics)
+PROFILE_STAGE = None  # Stage whose spans run under cProfile (--profile), saved as <stage>.prof in the workdir
+
+# Spans recorded in this process (or thread pool) and not yet written out
+_spans = []
+_spans_lock = threading.Lock()
+_profiling = threading.local()
+_profile_stats = None
+
 # API Request functions
 def get_tokens():
     try:
@@ -25,7 +127,7 @@ def get_tokens():
 def get_utc_offset():
     try:
         utc_offset = input("Which timezone do you want to filter the data? (e.g. +00:00, -03:00, +01:00): ")
-        if re.match(r"^[+-]\d{2}:00$", utc_offset):
+        if re.match(UTC_OFFSET_PATTERN, utc_offset):
             return utc_offset
         else:
             raise ValueError("Invalid UTC offset format.")
@@ -55,407 +157,1463 @@ def format_date_period(start_date, end_date):
         logging.error("Error formatting date period: %s", e)
         return None
 
-def make_api_request(api_token, app_tokens, utc_offset, date_period, dimensions, metrics, filename):
+def create_session(pool_size=POOL_SIZE):
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+    # One pooled session per run: connections are reused across reports and
+    # 429/5xx responses are retried with bounded exponential backoff, honoring Retry-After
+    retry = Retry(
+        total=MAX_RETRIES,
+        backoff_factor=BACKOFF_FACTOR,
+        backoff_max=BACKOFF_MAX,
+        status_forcelist=RETRY_STATUS_CODES,
+        allowed_methods=frozenset(['GET']),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    # pool_block makes extra concurrent requests wait for a free connection instead of opening throwaway ones
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry, pool_block=True)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+def open_output(destination, mode='wb', **kwargs):
+    # Outputs are either file paths or in-memory buffers (in-memory pipeline)
+    if hasattr(destination, 'write'):
+        return contextlib.nullcontext(destination)
+    return open(destination, mode, **kwargs)
+
+def build_report_url(app_tokens, utc_offset, date_period, dimensions, metrics):
+    app_token_param = ""
+    if app_tokens:
+        app_token_string = ','.join(app_tokens)
+        app_token_param = f"&app_token__in={app_token_string}"
+    return f"{API_BASE_URL}?utc_offset={utc_offset}{app_token_param}&reattributed=all&attribution_source=dynamic&attribution_type=all&ad_spend_mode=network&date_period={date_period}&cohort_maturity=immature&sandbox=false&assisting_attribution_type=all&ironsource_mode=ironsource&dimensions={dimensions}&metrics={metrics}&sort=-installs&is_report_setup_open=true"
+
+def make_api_request(api_token, app_tokens, utc_offset, date_period, dimensions, metrics, filename, session=None):
+    import requests
     try:
         headers = {"Authorization": f"Bearer {api_token}"}
-        app_token_param = ""
-        if app_tokens:
-            app_token_string = ','.join(app_tokens)
-            app_token_param = f"&app_token__in={app_token_string}"
-        url = f"https://dash.adjust.com/control-center/reports-service/csv_report?utc_offset={utc_offset}{app_token_param}&reattributed=all&attribution_source=dynamic&attribution_type=all&ad_spend_mode=network&date_period={date_period}&cohort_maturity=immature&sandbox=false&assisting_attribution_type=all&ironsource_mode=ironsource&dimensions={dimensions}&metrics={metrics}&sort=-installs&is_report_setup_open=true"
-        response = requests.get(url, headers=headers)
-        if response.status_code == 200:
-            with open(filename, 'w') as file:
-                file.write(response.text)
-            logging.info(f"Data saved to '{filename}'")
-            return url  # Return the URL for audit logging
+        url = build_report_url(app_tokens, utc_offset, date_period, dimensions, metrics)
+        # Stream the body straight to its destination so the response is never buffered as a whole
+        with span('fetch', f"request {dimensions} {date_period}", app_tokens=len(app_tokens) if app_tokens else 'all') as details, \
+                _api_slots or contextlib.nullcontext(), (session or requests).get(url, headers=headers, timeout=REQUEST_TIMEOUT, stream=True) as response:
+            details['status'] = response.status_code
+            if response.status_code == 200:
+                details['bytes'] = 0
+                with open_output(filename) as file:
+                    for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                        file.write(chunk)
+                        details['bytes'] += len(chunk)
+                logging.info(f"Data saved to '{filename}'" if isinstance(filename, str) else f"Data for '{dimensions}' received in memory")
+                return url  # Return the URL for audit logging
+            else:
+                logging.error("Failed to fetch data. Status code: %s", response.status_code)
+                return None
+    except Exception as e:
+        logging.error("Error making API request: %s", e)
+        return None
+
+def fetch_report(api_token, app_tokens, utc_offset, start_date, end_date, dimensions, metrics, filename, session=None, cache_dir=CACHE_DIR):
+    # Serve the report from the local cache when possible, otherwise fetch and cache it.
+    # Returns the requested URLs for the audit trail, or None on failure.
+    key = report_cache_key(api_token, app_tokens, utc_offset, start_date, end_date, dimensions, metrics)
+    if key and cache_dir:
+        with span('fetch', f"cache {dimensions} {start_date}/{end_date}") as details:
+            url = read_cached_report(cache_dir, key, filename)
+            details['hit'] = bool(url)
+        if url:
+            return [url]
+    date_period = format_date_period(start_date, end_date)
+    if not date_period:
+        return None
+    url = make_api_request(api_token, app_tokens, utc_offset, date_period, dimensions, metrics, filename, session)
+    if url and key and cache_dir:
+        write_cached_report(cache_dir, key, filename, url, report_cache_ttl(end_date))
+    return [url] if url else None
+
+def fetch_report_sharded(api_token, app_tokens, utc_offset, start_date, end_date, dimensions, metrics, filename, session=None, cache_dir=CACHE_DIR, shard_size=None):
+    # Hundreds of app tokens make a huge URL in one request, and one bad token fails it all.
+    # Fetch the tokens in shards concurrently instead and write their rows as one report;
+    # load_report sums them and re-weights rate metrics by installs. A shard that fails is
+    # left out of the report and recorded as failed in the audit trail.
+    shard_size = shard_size or APP_TOKEN_SHARD_SIZE
+    if not app_tokens or len(app_tokens) <= shard_size:
+        return fetch_report(api_token, app_tokens, utc_offset, start_date, end_date, dimensions, metrics, filename, session, cache_dir)
+    try:
+        shards = [app_tokens[i:i + shard_size] for i in range(0, len(app_tokens), shard_size)]
+        with tempfile.TemporaryDirectory(prefix='autoqbr-shards-') as parts_dir:
+            parts = [os.path.join(parts_dir, f"shard_{i}.csv") for i in range(len(shards))]
+            with ThreadPoolExecutor(max_workers=min(len(shards), POOL_SIZE)) as executor:
+                futures = [executor.submit(fetch_report, api_token, shard, utc_offset, start_date, end_date, dimensions, metrics, part, session, cache_dir)
+                           for shard, part in zip(shards, parts)]
+                results = [future.result() for future in futures]
+            fetched, urls = [], []
+            for shard, part, shard_urls in zip(shards, parts, results):
+                if shard_urls:
+                    fetched.append(part)
+                    urls.extend(shard_urls)
+                else:
+                    logging.error(f"Shard of {len(shard)} app tokens failed for '{dimensions}' and is excluded from the report: {' '.join(shard)}")
+                    urls.append((FAILED_SHARD, build_report_url(shard, utc_offset, format_date_period(start_date, end_date), dimensions, metrics)))
+            if not fetched:
+                return None
+            merge_report_files(fetched, filename)
+        return urls
+    except Exception as e:
+        logging.error("Error fetching app token shards: %s", e)
+        return None
+
+def fetch_reports(api_token, app_tokens, utc_offset, start_date, end_date, reports=REPORTS, session=None, cache_dir=CACHE_DIR, workdir='.', destinations=None, history_db=None):
+    # Issue all report requests at once over a shared connection pool, so a run
+    # takes about as long as the slowest report instead of the sum of all of them.
+    # destinations optionally maps report filenames to in-memory buffers, and with a
+    # history_db only months missing from the history store are requested.
+    # Returns the requested URLs of each report, or None for reports that failed.
+    if session is None:
+        # Own the pool only for this call, so its connections are closed afterwards
+        with create_session() as session:
+            return fetch_reports(api_token, app_tokens, utc_offset, start_date, end_date, reports, session, cache_dir, workdir, destinations, history_db)
+    destinations = destinations or {filename: os.path.join(workdir, filename) for _, _, filename in reports}
+    with ThreadPoolExecutor(max_workers=len(reports)) as executor:
+        if history_db:
+            futures = [executor.submit(fetch_report_with_history, history_db, api_token, app_tokens, utc_offset, start_date, end_date, dimensions, metrics, destinations[filename], session, cache_dir)
+                       for dimensions, metrics, filename in reports]
         else:
-            logging.error("Failed to fetch data. Status code: %s", response.status_code)
+            futures = [executor.submit(fetch_report_chunked, api_token, app_tokens, utc_offset, start_date, end_date, dimensions, metrics, destinations[filename], session, cache_dir)
+                       for dimensions, metrics, filename in reports]
+        return [future.result() for future in futures]
+
+# Report cache functions
+def report_cache_key(api_token, app_tokens, utc_offset, start_date, end_date, dimensions, metrics):
+    # Key on absolute dates and order-insensitive token/dimension/metric sets, so the same
+    # query maps to the same entry on any day. The (hashed) API token is part of the key:
+    # a cached report is only served to a token the report service already answered for it.
+    try:
+        query = {
+            'account': hashlib.sha256(api_token.encode()).hexdigest(),  # Never store the token itself
+            'utc_offset': utc_offset,
+            'start_date': datetime.strptime(start_date, '%Y-%m-%d').date().isoformat(),
+            'end_date': datetime.strptime(end_date, '%Y-%m-%d').date().isoformat(),
+            'dimensions': sorted(set(dimensions.split(','))),
+            'metrics': sorted(set(metrics.split(','))),
+        }
+        query['app_tokens'] = sorted(set(app_tokens)) if app_tokens else 'all'
+        return hashlib.sha256(json.dumps(query, sort_keys=True).encode()).hexdigest()
+    except Exception as e:
+        logging.error("Error building report cache key: %s", e)
+        return None
+
+def is_closed_period(end_date):
+    # Periods ending before the current month are final, anything else may still change
+    month_start = datetime.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    return datetime.strptime(end_date, '%Y-%m-%d') < month_start
+
+def report_cache_ttl(end_date):
+    return CACHE_TTL_CLOSED if is_closed_period(end_date) else CACHE_TTL_OPEN
+
+def read_cached_report(cache_dir, key, filename):
+    try:
+        data_path = os.path.join(cache_dir, 'reports', f"{key}.csv")
+        meta_path = os.path.join(cache_dir, 'reports', f"{key}.json")
+        if not (os.path.exists(data_path) and os.path.exists(meta_path)):
+            return None
+        with open(meta_path) as file:
+            meta = json.load(file)
+        if meta['expires_at'] < time.time():
+            logging.info(f"Cached report '{data_path}' expired")
             return None
+        with open(data_path, 'rb') as source, open_output(filename) as file:
+            shutil.copyfileobj(source, file)
+        os.utime(data_path)  # Mark as recently used for LRU eviction
+        logging.info(f"Data for '{data_path}' loaded from cache")
+        return meta['url']
     except Exception as e:
-        logging.error("Error making API request: %s", e)
+        logging.warning("Error reading report cache: %s", e)
+        return None
+
+def write_cached_report(cache_dir, key, filename, url, ttl):
+    try:
+        directory = os.path.join(cache_dir, 'reports')
+        os.makedirs(directory, exist_ok=True)
+        # Write to temporary names and rename, so concurrent runs never see partial entries
+        data_tmp = os.path.join(directory, f"{key}.csv.{os.getpid()}.tmp")
+        meta_tmp = os.path.join(directory, f"{key}.json.{os.getpid()}.tmp")
+        if hasattr(filename, 'getvalue'):
+            with open(data_tmp, 'wb') as file:
+                file.write(filename.getvalue())
+        else:
+            shutil.copyfile(filename, data_tmp)
+        with open(meta_tmp, 'w') as file:
+            json.dump({'url': url, 'expires_at': time.time() + ttl}, file)
+        os.replace(data_tmp, os.path.join(directory, f"{key}.csv"))
+        os.replace(meta_tmp, os.path.join(directory, f"{key}.json"))
+        evict_lru(directory, CACHE_MAX_BYTES)
+    except Exception as e:
+        logging.warning("Error writing report cache: %s", e)
+
+def evict_lru(directory, max_bytes):
+    # Drop least recently used entries (all files sharing a key) until the directory fits
+    entries = {}
+    for name in os.listdir(directory):
+        if name.endswith('.tmp'):
+            continue
+        path = os.path.join(directory, name)
+        stat = os.stat(path)
+        key = name.split('.', 1)[0]
+        size, last_used = entries.get(key, (0, 0))
+        entries[key] = (size + stat.st_size, max(last_used, stat.st_mtime))
+    total = sum(size for size, _ in entries.values())
+    for key, (size, _) in sorted(entries.items(), key=lambda item: item[1][1]):
+        if total <= max_bytes:
+            break
+        for name in os.listdir(directory):
+            if name.split('.', 1)[0] == key:
+                os.remove(os.path.join(directory, name))
+        total -= size
+        logging.info(f"Evicted cache entry {key}")
+
+# Chart cache functions
+_source_digest = None
+
+def chart_cache_key(spec, data):
+    # Same input slice, chart spec, style, drawing code and library versions: same PNG.
+    # Library versions come from package metadata, so a fully cached run never imports them.
+    global _source_digest
+    from importlib import metadata
+    if _source_digest is None:
+        with open(__file__, 'rb') as file:
+            _source_digest = hashlib.sha256(file.read()).hexdigest()
+    try:
+        versions = [metadata.version(package) for package in ('matplotlib', 'seaborn', 'pandas')]
+    except metadata.PackageNotFoundError as e:
+        # Without versions a library upgrade could serve stale charts, so render them
+        logging.warning("Chart cache disabled, no version found for %s", e)
+        return None
+    digest = hashlib.sha256(json.dumps({
+        'spec': spec,
+        'style': CHART_STYLE,
+        'code': _source_digest,
+        'versions': versions,
+        'columns': [[str(column), str(dtype)] for column, dtype in data.dtypes.items()],
+    }, sort_keys=True, default=str).encode())
+    digest.update(data.to_csv(index=False).encode())
+    return digest.hexdigest()
+
+def read_cached_chart(cache_dir, key, name, path):
+    # Copy a cached chart to path and return it, or return its bytes when path is None
+    cached = os.path.join(cache_dir, f"{key}.png")
+    if not os.path.exists(cached):
+        return None
+    try:
+        with span('render', f"chart {name}", cached=True):
+            if path is None:
+                with open(cached, 'rb') as file:
+                    rendered = file.read()
+            else:
+                rendered = shutil.copyfile(cached, path)
+        os.utime(cached)  # Mark as recently used for LRU eviction
+        logging.info(f"Chart '{name}' unchanged, copied from the chart cache")
+        return rendered
+    except Exception as e:
+        logging.warning("Error reading chart cache: %s", e)
+        return None
+
+def write_cached_chart(cache_dir, key, rendered):
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        # Write to a temporary name and rename, so concurrent runs never see partial charts
+        tmp = os.path.join(cache_dir, f"{key}.png.{os.getpid()}.tmp")
+        if isinstance(rendered, bytes):
+            with open(tmp, 'wb') as file:
+                file.write(rendered)
+        else:
+            shutil.copyfile(rendered, tmp)
+        os.replace(tmp, os.path.join(cache_dir, f"{key}.png"))
+        return True
+    except Exception as e:
+        logging.warning("Error writing chart cache: %s", e)
+        return False
+
+# History store functions
+def split_date_range(start_date, end_date):
+    # Month-aligned sub-ranges covering start_date..end_date, clipped to the range
+    start = datetime.strptime(start_date, '%Y-%m-%d').date()
+    end = datetime.strptime(end_date, '%Y-%m-%d').date()
+    slices = []
+    while start <= end:
+        next_month = date(start.year + start.month // 12, start.month % 12 + 1, 1)
+        slice_end = min(end, next_month - timedelta(days=1))
+        slices.append((start.isoformat(), slice_end.isoformat()))
+        start = next_month
+    return slices
+
+def history_account_key(api_token, app_tokens, utc_offset):
+    # Same identity rules as the report cache: the (hashed) API token plus the app tokens or "all"
+    account = {
+        'account': hashlib.sha256(api_token.encode()).hexdigest(),
+        'utc_offset': utc_offset,
+        'app_tokens': sorted(set(app_tokens)) if app_tokens else 'all',
+    }
+    return hashlib.sha256(json.dumps(account, sort_keys=True).encode()).hexdigest()
+
+def history_report_key(dimensions, metrics):
+    # Order-insensitive, like the report cache key
+    return f"{','.join(sorted(set(dimensions.split(','))))}|{','.join(sorted(set(metrics.split(','))))}"
+
+def open_history(path):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")  # Let parallel runs read while one of them writes
+    conn.execute("""CREATE TABLE IF NOT EXISTS slices (
+        account TEXT, report TEXT, start_date TEXT, end_date TEXT, closed INTEGER, url TEXT, fetched_at REAL,
+        PRIMARY KEY (account, report, start_date, end_date))""")
+    # Older versions stored one JSON row per report row here; those months are fetched once more as files
+    conn.execute("DROP TABLE IF EXISTS report_rows")
+    return conn
+
+def history_slice_path(history_db, account, report, start_date, end_date):
+    # Each stored month is the CSV the report service sent, in a folder next to the database
+    key = hashlib.sha256(json.dumps([account, report, start_date, end_date]).encode()).hexdigest()
+    return os.path.join(f"{os.path.splitext(history_db)[0]}_slices", f"{key}.csv")
+
+def load_history_slice(conn, history_db, account, report, start_date, end_date):
+    # Stored CSV, requested URLs and fetch time of a closed slice, or None if it has to be fetched
+    found = conn.execute("SELECT url, fetched_at FROM slices WHERE account=? AND report=? AND start_date=? AND end_date=? AND closed=1",
+                         (account, report, start_date, end_date)).fetchone()
+    path = history_slice_path(history_db, account, report, start_date, end_date)
+    if not found or not os.path.exists(path):
+        return None
+    url, fetched_at = found
+    # One URL per app token shard, stored as a JSON list (a plain URL for older entries)
+    urls = json.loads(url) if url.startswith('[') else [url]
+    return path, urls, fetched_at
+
+def is_settled_period(end_date, utc_offset, now=None):
+    # Final once the period has ended in the report's timezone and late data had a few days to
+    # arrive; until then the slice is stored as open and fetched again on the next run
+    local_today = (now or datetime.now(timezone.utc)).astimezone(timezone(timedelta(hours=int(utc_offset[:3])))).date()
+    return local_today > datetime.strptime(end_date, '%Y-%m-%d').date() + timedelta(days=HISTORY_SETTLE_DAYS)
+
+def store_history_slice(conn, history_db, account, report, start_date, end_date, utc_offset, part, url):
+    path = history_slice_path(history_db, account, report, start_date, end_date)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Copy to a temporary name and rename, so parallel runs never read a partial month
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    shutil.copyfile(part, tmp)
+    os.replace(tmp, path)
+    with conn:
+        conn.execute("INSERT OR REPLACE INTO slices (account, report, start_date, end_date, closed, url, fetched_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                     (account, report, start_date, end_date, int(is_settled_period(end_date, utc_offset)), url, time.time()))
+
+def fetch_chunk(api_token, app_tokens, utc_offset, chunk_start, chunk_end, dimensions, metrics, session, cache_dir, parts_dir):
+    # Stream one sub-range to its own file in parts_dir; a retry overwrites it
+    part = os.path.join(parts_dir, f"{chunk_start}_{chunk_end}.csv")
+    chunk_urls = fetch_report_sharded(api_token, app_tokens, utc_offset, chunk_start, chunk_end, dimensions, metrics, part, session, cache_dir)
+    if not chunk_urls:
+        return None
+    return part, chunk_urls
+
+def fetch_chunks(api_token, app_tokens, utc_offset, chunks, dimensions, metrics, session, cache_dir, parts_dir, concurrency=CHUNK_CONCURRENCY, retries=CHUNK_RETRIES):
+    # Fetch sub-ranges concurrently (at most `concurrency` at a time) into files in parts_dir; when
+    # some fail, only those are retried in the next round. Returns {chunk: (path, urls)}, or None if a chunk kept failing.
+    results, pending = {}, list(chunks)
+    with ThreadPoolExecutor(max_workers=max(1, min(len(pending), concurrency))) as executor:
+        for attempt in range(retries + 1):
+            if attempt:
+                delay = min(BACKOFF_MAX, BACKOFF_FACTOR * 2 ** (attempt - 1))
+                logging.warning(f"Retrying {len(pending)} failed chunk(s) of '{dimensions}' in {delay}s")
+                time.sleep(delay)
+            futures = [(chunk, executor.submit(fetch_chunk, api_token, app_tokens, utc_offset, chunk[0], chunk[1], dimensions, metrics, session, cache_dir, parts_dir))
+                       for chunk in pending]
+            pending = []
+            for chunk, future in futures:
+                fetched = future.result()
+                if fetched:
+                    results[chunk] = fetched
+                else:
+                    pending.append(chunk)
+            if not pending:
+                return results
+    logging.error(f"Failed to fetch {len(pending)} chunk(s) of '{dimensions}': {', '.join(f'{start}/{end}' for start, end in pending)}")
+    return None
+
+def read_report_header(path):
+    # Columns of a fetched report part, and whether it has any rows
+    with open(path, 'rb') as file:
+        header = file.readline().decode()
+        has_rows = bool(file.readline().strip())
+    return next(csv.reader([header]), []), has_rows
+
+def merge_report_files(parts, filename):
+    # Write the rows of every part (chunk, shard or stored month), in order, under one header;
+    # load_report aggregates them per key. Parts are copied block by block, so memory stays flat
+    # however large the report is; only a part with other columns is rewritten row by row.
+    # Fetching only moves rows around, so it sticks to the csv module and never imports pandas.
+    headers = [read_report_header(part) for part in parts]
+    # Parts without rows add no columns, unless no part has rows (the report keeps its shape)
+    with_rows = [(part, columns) for part, (columns, has_rows) in zip(parts, headers) if has_rows]
+    columns = list(dict.fromkeys(column for _, part_columns in with_rows for column in part_columns)) or headers[0][0]
+    text = io.StringIO()
+    writer = csv.writer(text, lineterminator='\n')
+    writer.writerow(columns)
+    with open_output(filename) as output:
+        output.write(text.getvalue().encode())
+        for part, part_columns in with_rows:
+            if part_columns == columns:
+                with open(part, 'rb') as file:
+                    file.seek(-1, os.SEEK_END)
+                    missing_newline = file.read(1) != b'\n'
+                    file.seek(0)
+                    file.readline()  # Header already written
+                    shutil.copyfileobj(file, output, DOWNLOAD_CHUNK_SIZE)
+                if missing_newline:
+                    output.write(b'\n')
+                continue
+            with open(part, newline='') as file:
+                for row in csv.DictReader(file):
+                    text.seek(0)
+                    text.truncate()
+                    writer.writerow([row.get(column, '') for column in columns])
+                    output.write(text.getvalue().encode())
+
+def read_report_header(path):
+    # Columns of a fetched report part, and whether it has any rows
+    with open(path, 'rb') as file:
+        header = file.readline().decode()
+        has_rows = bool(file.readline().strip())
+    return next(csv.reader([header]), []), has_rows
+
+def merge_report_files(parts, filename):
+    # Write the rows of every part (chunk, shard or stored month), in order, under one header;
+    # load_report aggregates them per key. Parts are copied block by block, so memory stays flat
+    # however large the report is; only a part with other columns is rewritten row by row.
+    # Fetching only moves rows around, so it sticks to the csv module and never imports pandas.
+    headers = [read_report_header(part) for part in parts]
+    # Parts without rows add no columns, unless no part has rows (the report keeps its shape)
+    with_rows = [(part, columns) for part, (columns, has_rows) in zip(parts, headers) if has_rows]
+    columns = list(dict.fromkeys(column for _, part_columns in with_rows for column in part_columns)) or headers[0][0]
+    text = io.StringIO()
+    writer = csv.writer(text, lineterminator='\n')
+    writer.writerow(columns)
+    with open_output(filename) as output:
+        output.write(text.getvalue().encode())
+        for part, part_columns in with_rows:
+            if part_columns == columns:
+                with open(part, 'rb') as file:
+                    file.seek(-1, os.SEEK_END)
+                    missing_newline = file.read(1) != b'\n'
+                    file.seek(0)
+                    file.readline()  # Header already written
+                    shutil.copyfileobj(file, output, DOWNLOAD_CHUNK_SIZE)
+                if missing_newline:
+                    output.write(b'\n')
+                continue
+            with open(part, newline='') as file:
+                for row in csv.DictReader(file):
+                    text.seek(0)
+                    text.truncate()
+                    writer.writerow([row.get(column, '') for column in columns])
+                    output.write(text.getvalue().encode())
+
+def fetch_report_chunked(api_token, app_tokens, utc_offset, start_date, end_date, dimensions, metrics, filename, session=None, cache_dir=CACHE_DIR):
+    # A long range is one slow request that has to restart from scratch on any failure:
+    # fetch it as concurrent monthly chunks instead, retrying only the chunks that fail
+    try:
+        chunks = split_date_range(start_date, end_date)
+        if len(chunks) <= LONG_RANGE_MONTHS:
+            return fetch_report_sharded(api_token, app_tokens, utc_offset, start_date, end_date, dimensions, metrics, filename, session, cache_dir)
+        logging.info(f"Fetching '{dimensions}' as {len(chunks)} monthly chunks")
+        with tempfile.TemporaryDirectory(prefix='autoqbr-chunks-') as parts_dir:
+            results = fetch_chunks(api_token, app_tokens, utc_offset, chunks, dimensions, metrics, session, cache_dir, parts_dir)
+            if results is None:
+                return None
+            merge_report_files([results[chunk][0] for chunk in chunks], filename)
+        return [url for chunk in chunks for url in results[chunk][1]]
+    except Exception as e:
+        logging.error("Error fetching report chunks: %s", e)
+        return None
+
+def fetch_report_with_history(history_db, api_token, app_tokens, utc_offset, start_date, end_date, dimensions, metrics, filename, session=None, cache_dir=CACHE_DIR):
+    # Split the range into months, reuse closed months from the history store and fetch only
+    # months that are missing or still open, then write the stored and fetched rows as one report
+    try:
+        account = history_account_key(api_token, app_tokens, utc_offset)
+        report = history_report_key(dimensions, metrics)
+        conn = open_history(history_db)
+        try:
+            slices = split_date_range(start_date, end_date)
+            parts, urls, missing = {}, {}, []
+            with span('fetch', f"history {dimensions}", months=len(slices)) as details:
+                for chunk in slices:
+                    stored = load_history_slice(conn, history_db, account, report, *chunk)
+                    if stored:
+                        parts[chunk], stored_urls, fetched_at = stored
+                        # Not requested in this run: mark it as served from history in the audit trail
+                        header = f"Served from history ({chunk[0]}/{chunk[1]}, fetched {datetime.fromtimestamp(fetched_at):%Y-%m-%d %H:%M})"
+                        urls[chunk] = [(header, url) for url in stored_urls]
+                    else:
+                        missing.append(chunk)
+                details['stored'] = len(parts)
+            logging.info(f"History has {len(parts)} of {len(slices)} months for '{dimensions}', fetching {len(missing)}")
+            with tempfile.TemporaryDirectory(prefix='autoqbr-chunks-') as parts_dir:
+                if missing:
+                    results = fetch_chunks(api_token, app_tokens, utc_offset, missing, dimensions, metrics, session, cache_dir, parts_dir)
+                    if results is None:
+                        return None
+                    for chunk in missing:
+                        parts[chunk], urls[chunk] = results[chunk]
+                        # Months missing a failed app token shard are used for this run but never stored
+                        if not any(isinstance(entry, tuple) and entry[0] == FAILED_SHARD for entry in urls[chunk]):
+                            store_history_slice(conn, history_db, account, report, *chunk, utc_offset, parts[chunk], json.dumps(urls[chunk]))
+                # The bundled CSV keeps the raw rows of every month
+                merge_report_files([parts[chunk] for chunk in slices], filename)
+        finally:
+            conn.close()
+        return [entry for chunk in slices for entry in urls[chunk]]
+    except Exception as e:
+        logging.error("Error merging report history: %s", e)
         return None
-    
+
 # Zip file functions
 def zip_outputs(output_files, output_zip):
-    with zipfile.ZipFile(output_zip, 'w', zipfile.ZIP_DEFLATED) as zipf:
+    with open_bundle(output_zip) as add:
         for file in output_files:
-            if os.path.exists(file):
-                zipf.write(file, arcname=os.path.basename(file))
-                logging.info(f"Added {file} to {output_zip}")
-                os.remove(file)  # This line deletes the file after adding it to the zip
-                logging.info(f"Deleted {file} after adding to ZIP")
-            else:
-                logging.warning(f"File {file} not found and was not added to the ZIP archive.")
-    logging.info(f"All specified files are zipped into {output_zip}")
+            add(file, remove=True)
+
+@contextlib.contextmanager
+def open_bundle(output_zip, compress_level=None):
+    # Open the ZIP archive (a path or a binary buffer) and yield add(source, data=None, remove=False),
+    # which queues a file, or bytes under the name source, as soon as it's ready. A background
+    # thread writes the queue in order, so compression overlaps with fetching and rendering
+    # (zlib releases the GIL). The archive is complete once the block exits.
+    level = ZIP_COMPRESS_LEVEL if compress_level is None else compress_level
+    futures = []
+    with zipfile.ZipFile(output_zip, 'w') as zipf, ThreadPoolExecutor(max_workers=1) as writer:
+        def add(source, data=None, remove=False):
+            futures.append(writer.submit(add_to_bundle, zipf, source, data, level, remove))
+        yield add
+        for future in futures:
+            future.result()  # Raise the first member that couldn't be written
+    added = sum(1 for future in futures if future.result())
+    logging.info(f"{added} outputs are zipped into {output_zip}" if isinstance(output_zip, str) else f"{added} outputs are zipped in memory")
+
+def add_to_bundle(zipf, source, data, level, remove):
+    # Store already compressed formats as they are and deflate the rest; True once added
+    arcname = os.path.basename(source)
+    compression = zipfile.ZIP_STORED if arcname.lower().endswith(STORED_EXTENSIONS) else zipfile.ZIP_DEFLATED
+    if data is not None:
+        with span('bundle', f"zip {arcname}", bytes=len(data), compressed=compression == zipfile.ZIP_DEFLATED):
+            zipf.writestr(arcname, data, compression, level)
+    elif os.path.exists(source):
+        with span('bundle', f"zip {arcname}", bytes=os.path.getsize(source), compressed=compression == zipfile.ZIP_DEFLATED):
+            zipf.write(source, arcname, compression, level)
+        if remove:
+            os.remove(source)
+    else:
+        logging.warning(f"File {source} not found and was not added to the ZIP archive.")
+        return False
+    logging.debug(f"Added {arcname} to the ZIP archive")
+    return True
+
+# Report loading functions
+def aggregate_report(frames, key):
+    # Sum every frame per key (one dimension or several, comma separated) and recombine rate
+    # metrics weighted by their base metric. Only one aggregated row per key is kept in memory at a time.
+    import pandas as pd
+    key = key.split(',')
+    totals = None
+    for frame in frames:
+        if frame.empty:
+            continue  # Periods without data (e.g. a month with no rows) add nothing
+        frame = frame.copy()
+        for rate, weight in RATE_METRICS.items():
+            if rate in frame.columns and weight in frame.columns:
+                frame[rate] = frame[rate] * frame[weight]
+        partial = frame.groupby(key, sort=False, observed=True).sum(numeric_only=True)
+        totals = partial if totals is None else totals.add(partial, fill_value=0)
+    if totals is None:
+        return pd.DataFrame(columns=key)
+    for rate, weight in RATE_METRICS.items():
+        if rate in totals.columns and weight in totals.columns:
+            totals[rate] = (totals[rate] / totals[weight].where(totals[weight] != 0)).fillna(0)
+    return totals.reset_index()
+
+def read_report(filename, key, chunksize, typed=True):
+    # Chunks of the report CSV, limited to the schema's columns and typed by it
+    if hasattr(filename, 'seek'):
+        filename.seek(0)
+    import pandas as pd
+    dtype = dict(REPORT_SCHEMA, **{dimension: REPORT_SCHEMA.get(dimension, 'category') for dimension in key.split(',')})
+    # Metrics outside the schema (e.g. of a breakdown) are loaded too, with inferred types
+    requested = {metric for _, metrics, _ in REPORTS for metric in metrics.split(',')}
+    return pd.read_csv(filename, chunksize=chunksize, usecols=lambda column: column in dtype or column in requested, dtype=dtype if typed else None)
+
+def load_report(filename, key, chunksize=CSV_CHUNK_ROWS):
+    # Parse the CSV in chunks and aggregate incrementally, so peak memory stays flat
+    # no matter how large the downloaded report is
+    with span('parse', f"parse {key} report") as details:
+        try:
+            report = aggregate_report(read_report(filename, key, chunksize), key)
+        except ValueError as e:
+            # e.g. empty cells in a count column: fall back to the types pandas infers
+            logging.warning("Report by '%s' doesn't match the schema (%s), loading it untyped", key, e)
+            report = aggregate_report(read_report(filename, key, chunksize, typed=False), key)
+        for dimension in key.split(','):
+            if REPORT_SCHEMA.get(dimension, 'category') == 'category':
+                report[dimension] = report[dimension].astype('category')  # Merged chunks come back as plain strings
+        details['rows'] = len(report)
+    return report
+
+# Derived metric functions
+# Derived metrics registry: each metric is computed once per report, vectorized, after the
+# metrics it is computed from, and shared by every chart that uses it
+DERIVED_METRICS = {}
+
+def register_metric(name, sources, inputs, compute):
+    DERIVED_METRICS[name] = dict(name=name, sources=sources, inputs=inputs, compute=compute)
+
+def organic_mask(data):
+    # Rows whose traffic source dimensions name organic traffic. On a categorical column
+    # the match runs once per distinct value, not once per row.
+    mask = data.index.isin([])
+    for dimension in ORGANIC_DIMENSIONS:
+        if dimension in data.columns:
+            mask = mask | data[dimension].str.contains("Organic", case=False, na=False).astype(bool)
+    return mask
+
+register_metric('total_attributions', ['month'], ['installs', 'reattributions'],
+                lambda data: data['installs'] + data['reattributions'])
+# Installs and reattributions as percentage of the total attributions
+register_metric('percent_installs', ['month'], ['installs', 'total_attributions'],
+                lambda data: data['installs'] / data['total_attributions'] * 100)
+register_metric('percent_reattributions', ['month'], ['reattributions', 'total_attributions'],
+                lambda data: data['reattributions'] / data['total_attributions'] * 100)
+register_metric('organic_installs', ['month'], ['installs', 'organic_install_rate'],
+                lambda data: data['installs'] * data['organic_install_rate'])
+register_metric('paid_installs', ['month'], ['installs', 'organic_installs'],
+                lambda data: data['installs'] - data['organic_installs'])
+register_metric('rejected_attributions', ['channel'], ['rejected_installs', 'rejected_reattributions'],
+                lambda data: data['rejected_installs'] + data['rejected_reattributions'])
+# Computed once per report and shared by every chart excluding organic traffic. Breakdowns by
+# a traffic source dimension add their report to the sources (see register_breakdown).
+register_metric('is_organic', ['channel'], [], organic_mask)
+
+def metric_order(source):
+    # Derived metrics of a report, each one after the metrics it is computed from
+    ordered = []
+    def visit(name):
+        if name in DERIVED_METRICS and name not in ordered:
+            for dependency in DERIVED_METRICS[name]['inputs']:
+                visit(dependency)
+            ordered.append(name)
+    for name, metric in DERIVED_METRICS.items():
+        if source in metric['sources']:
+            visit(name)
+    return ordered
+
+def report_metrics(metric):
+    # Metrics to request from the report service for a metric: itself, or what a derived one is computed from
+    if metric not in DERIVED_METRICS:
+        return [metric]
+    return list(dict.fromkeys(base for name in DERIVED_METRICS[metric]['inputs'] for base in report_metrics(name)))
+
+def add_derived_metrics(data, source):
+    for name in metric_order(source):
+        missing = [column for column in DERIVED_METRICS[name]['inputs'] if column not in data.columns]
+        if missing:
+            # Leave it out: only the charts that use it fail, the others still render
+            logging.warning("Derived metric '%s' skipped, the report has no %s", name, ', '.join(missing))
+            continue
+        data[name] = DERIVED_METRICS[name]['compute'](data)
+    return data
 
 # Plotting functions
-def plot_data():
+# Chart registry: each chart is a spec (source report, input columns, output filename)
+# that is rendered on its own, so charts can be drawn in parallel and fail independently
+CHARTS = {}
+CHART_WORKERS = os.cpu_count() or 1  # Processes rendering charts in parallel
+CHART_STYLE = {'style': 'whitegrid', 'rc': {'axes.axisbelow': True}}  # Seaborn theme and matplotlib settings of every chart
+
+def register_chart(filename, kind, source, columns, **options):
+    CHARTS[filename] = dict(filename=filename, kind=kind, source=source, columns=columns, **options)
+
+def register_breakdown(dimensions, metric, top_n=BREAKDOWN_TOP_N, exclude_organic=True, other=False, title=None, filename=None):
+    # Top-N chart of a metric by any list of dimensions (e.g. ['country'] or ['campaign', 'network']).
+    # Registers the report it needs too: reports by the same dimensions share one request.
+    source = ','.join(dimensions)
+    requested = report_metrics(metric)
+    if not requested:
+        raise ValueError(f"'{metric}' is not computed from report metrics and has no top-N breakdown")
+    for index, (report_dimensions, metrics, report_file) in enumerate(REPORTS):
+        if report_dimensions == source:
+            missing = [name for name in requested if name not in metrics.split(',')]
+            if missing:
+                REPORTS[index] = (report_dimensions, ','.join([metrics] + missing), report_file)
+            break
+    else:
+        REPORTS.append((source, ','.join(requested), f"data_by_{'_'.join(dimensions)}.csv"))
+    # A derived metric is computed for this report too, after the ones it depends on
+    if metric in DERIVED_METRICS and source not in DERIVED_METRICS[metric]['sources']:
+        DERIVED_METRICS[metric]['sources'].append(source)
+    # Organic traffic can only be told apart by a traffic source dimension
+    exclude_organic = exclude_organic and any(dimension in ORGANIC_DIMENSIONS for dimension in dimensions)
+    if exclude_organic and source not in DERIVED_METRICS['is_organic']['sources']:
+        DERIVED_METRICS['is_organic']['sources'].append(source)
+    label = ' / '.join(dimension.replace('_', ' ').title() for dimension in dimensions)
+    metric_label = metric.replace('_', ' ').title()
+    title = title or f"Top {top_n} {metric_label} by {label}" + (" (Excluding Organic)" if exclude_organic else "")
+    filename = filename or f"top_{metric}_by_{'_'.join(dimensions)}.png"
+    register_chart(filename, 'top', source, [metric], dimensions=dimensions, top_n=top_n, exclude_organic=exclude_organic,
+                   other=other, xlabel=label, ylabel=metric_label, title=title)
+    return filename
+
+# PLOT 1: Monthly Installs and Reattributions (Percentage)
+register_chart('percent_installsxreattributions_by_month.png', 'stacked', 'month', ['percent_installs', 'percent_reattributions'],
+               series=[('percent_installs', 'darkblue', 'Installs', 'white'), ('percent_reattributions', 'lightblue', 'Reattributions', 'black')],
+               label_format='{:.1f}%', ylabel='Percentage', title='Monthly Installs and Reattributions (Percentage)')
+# PLOT 2: Monthly Installs and Reattributions (Absolute Values)
+register_chart('absolute_installsxreattributions_by_month.png', 'stacked', 'month', ['installs', 'reattributions'],
+               series=[('installs', 'darkblue', 'Installs', 'white'), ('reattributions', 'lightblue', 'Reattributions', 'black')],
+               ylabel='Count', title='Monthly Installs and Reattributions (Absolute Values)')
+# PLOT 3: Monthly Paid Installs and Organic Installs (Absolute Values)
+register_chart('absolute_paidinstallsxorganicinstalls_by_month.png', 'stacked', 'month', ['organic_installs', 'paid_installs'],
+               series=[('organic_installs', 'lightblue', 'Organic Installs', 'black'), ('paid_installs', 'darkblue', 'Paid Installs', 'white')],
+               ylabel='Count', title='Monthly Paid Installs and Organic Installs (Absolute Values)')
+# PLOT 4: Monthly Paid Installs (Absolute Values)
+register_chart('absolute_paidinstalls_by_month.png', 'stacked', 'month', ['paid_installs'],
+               series=[('paid_installs', 'darkblue', 'Paid Installs', 'white')],
+               ylabel='Count', title='Monthly Paid Installs (Absolute Values)')
+# PLOT 5: Top 5 installs by channel (Absolute Values)
+register_breakdown(['channel'], 'installs')
+# PLOT 6: Top 5 sessions by channel (Absolute Values)
+register_breakdown(['channel'], 'sessions')
+# PLOT 7: MAUs by month (Absolute Values)
+register_chart('maus_by_month.png', 'line', 'month', ['maus'],
+               label='MAUs', ylabel='MAUs', title='MAUs by Month')
+# PLOT 8: Monthly Rejected Installs and Rejected Reattributions (Absolute Values)
+register_chart('absolute_rejected_attributions_by_month.png', 'stacked', 'month', ['rejected_reattributions', 'rejected_installs'],
+               series=[('rejected_reattributions', 'lightblue', 'Rejected Reattributions', 'black'), ('rejected_installs', 'darkblue', 'Rejected Installs', 'white')],
+               ylabel='Count', title='Monthly Rejected Attributions')
+# PLOT 9: Rejected Attributions (Installs and Reattributions) by Channel (Absolute Values)
+register_breakdown(['channel'], 'rejected_attributions', title='Top 5 Rejected Attributions by Channel (Installs + Reattributions)')
+# PLOT 10: Monthly Sessions and Revenue Events (Absolute Values)
+register_chart('absolute_sessions_revevents_by_month.png', 'stacked', 'month', ['revenue_events', 'sessions'],
+               series=[('revenue_events', 'lightblue', 'Revenue Events', 'black'), ('sessions', 'darkblue', 'Sessions', 'white')],
+               ylabel='Count', title='Monthly Sessions and Revenue Events')
+# PLOT 11: Monthly Clicks and Impressions (Absolute Values)
+register_chart('absolute_clicks_impressions_by_month.png', 'stacked', 'month', ['clicks', 'impressions'],
+               series=[('clicks', 'darkblue', 'Clicks', 'white'), ('impressions', 'lightblue', 'Impressions', 'black')],
+               ylabel='Count', title='Monthly Clicks and Impressions')
+
+def prepare_month_data(data_by_month):
+    import pandas as pd
+    data_by_month['month'] = pd.to_datetime(data_by_month['month'], format='%Y-%m')  # Convert month to datetime for proper sorting
+    data_by_month = data_by_month.sort_values('month').reset_index(drop=True)  # Sort data by month
+    data_by_month['month'] = data_by_month['month'].dt.strftime('%b/%y')
+    return add_derived_metrics(data_by_month, 'month')
+
+def load_reports(sources):
+    # Load and prepare every report of REPORTS from sources ({filename: path or buffer}),
+    # keyed by its dimensions as chart specs refer to them
+    frames = {}
+    for dimensions, _, filename in REPORTS:
+        data = load_report(sources[filename], dimensions)
+        frames[dimensions] = prepare_month_data(data) if dimensions == 'month' else add_derived_metrics(data, dimensions)
+    return frames
+
+def top_breakdown(data, dimensions, metric, top_n=BREAKDOWN_TOP_N, exclude_organic=True, other=False):
+    # The top_n rows of a report by metric, as (label, metric) rows. Partial selection (nlargest)
+    # on the metric column alone: the report is neither sorted nor copied, however many rows it has.
+    # With other, everything outside the top is rolled up into one last row.
+    import pandas as pd
+    values = data[metric]
+    if exclude_organic:
+        values = values[~data['is_organic']]
+    top = values.nlargest(top_n)
+    # Plain string labels: seaborn would draw every category of a categorical axis, in category order
+    labels = data.loc[top.index, dimensions].astype(str).agg(' / '.join, axis=1)
+    breakdown = pd.DataFrame({'label': labels.to_numpy(), metric: top.to_numpy()})
+    if other and len(values) > top_n:
+        breakdown.loc[len(breakdown)] = [OTHER_LABEL, values.sum() - top.sum()]
+    return breakdown
+
+def chart_input(spec, frames):
+    # Only the rows and columns a chart needs are shipped to the worker rendering it
+    data = frames[spec['source']]
+    if spec['kind'] == 'top':
+        return top_breakdown(data, spec['dimensions'], spec['columns'][0], spec['top_n'], spec['exclude_organic'], spec['other'])
+    return data[['month'] + spec['columns']]
+
+def apply_chart_style():
+    # Ensure seaborn and matplotlib are configured for plotting
+    import seaborn as sns
+    import matplotlib.pyplot as plt
+    sns.set_theme(style=CHART_STYLE['style'])
+    plt.rcParams.update(CHART_STYLE['rc'])
+
+def _init_chart_worker():
+    import matplotlib.pyplot as plt
+    take_spans()  # Spans inherited from the parent process are not this worker's
+    plt.switch_backend('Agg')  # Workers render off-screen
+    apply_chart_style()
+
+def _draw_stacked(ax, spec, data):
+    # Stacked bars per month, one series on top of the other, labelled in the middle of each section.
+    # Each series is labelled in one pass over its bar container instead of row by row.
+    import seaborn as sns
+    bottom = None
+    label_format = spec.get('label_format', '{:,.0f}')
+    for column, color, label, text_color in spec['series']:
+        sns.barplot(x="month", y=column, data=data, bottom=bottom, color=color, label=label, ax=ax)
+        ax.bar_label(ax.containers[-1], fmt=label_format, label_type='center', color=text_color, fontweight='bold')
+        bottom = data[column] if bottom is None else bottom + data[column]
+    ax.set_xlabel('Month', fontweight='bold')
+
+def _draw_top(ax, spec, data):
+    # Bars for the top values of a breakdown
+    import seaborn as sns
+    metric = spec['columns'][0]
+    sns.barplot(x="label", y=metric, data=data, color='darkblue', label=spec['xlabel'], ax=ax)
+    for i, value in enumerate(data[metric]):
+        label_position = value / 2 if value > 0 else 0.1 * max(data[metric])
+        # Ensure the label is visible even for very small values
+        label_text = f"{value:,.0f}" if value > 0 else "<0.1"
+        ax.text(i, label_position, label_text, ha='center', va='center', color='white', fontweight='bold')
+    if len(data) > BREAKDOWN_TOP_N:
+        # More bars than the default leave less room per label
+        for tick_label in ax.get_xticklabels():
+            tick_label.set(rotation=30, ha='right')
+    ax.set_xlabel(spec['xlabel'], fontweight='bold')
+
+def _draw_line(ax, spec, data):
+    # Line chart per month with labels above each marker
+    import seaborn as sns
+    metric = spec['columns'][0]
+    sns.lineplot(x="month", y=metric, data=data, marker='o', color='darkblue', label=spec['label'], markersize=8, ax=ax)
+    offset = 0.02 * data[metric].max()
+    for i, value in enumerate(data[metric]):
+        ax.text(i, value + offset, f"{value:,.0f}", ha='center', va='bottom', color='black', fontweight='bold')
+    # Customize grid lines
+    ax.grid(True)
+    ax.grid(which='major', axis='y', linestyle='-', linewidth='0.5', color='gray')  # Enable only horizontal lines
+    ax.grid(which='major', axis='x', visible=False)  # Disable vertical lines
+    ax.set_xlabel('Month', fontweight='bold')
+
+CHART_KINDS = {'stacked': _draw_stacked, 'top': _draw_top, 'line': _draw_line}
+
+def _render_chart_in_worker(spec, data, path):
+    # Charts registered at run time (breakdowns) are unknown to a freshly spawned worker.
+    # Ship the chart's spans back with it, they are recorded in the worker process.
+    CHARTS.setdefault(spec['filename'], spec)
+    return render_chart(spec['filename'], data, path), take_spans()
+
+def render_chart(name, data, path=None):
+    # Save to path, or return the PNG bytes when no path is given
+    import matplotlib.pyplot as plt
+    spec = CHARTS[name]
+    with span('render', f"chart {name}"):
+        fig, ax = plt.subplots(figsize=(14, 7))
+        try:
+            CHART_KINDS[spec['kind']](ax, spec, data)
+            # Add legend and move it to avoid overlay
+            ax.legend(title="Metric", loc='upper left', bbox_to_anchor=(1, 1))
+            # Adding labels for clarity with bold font
+            ax.set_ylabel(spec['ylabel'], fontweight='bold')
+            ax.set_title(spec['title'], fontweight='bold')
+            # Save the plot as a PNG file
+            if path is None:
+                buffer = io.BytesIO()
+                fig.savefig(buffer, format='png', bbox_inches='tight')
+                return buffer.getvalue()
+            fig.savefig(path, bbox_inches='tight')
+            return path
+        finally:
+            # Release the figure right away, so memory stays bounded however many charts and reports are rendered
+            plt.close(fig)
+
+def render_charts(frames, workdir='.', workers=CHART_WORKERS, on_chart=None):
+    # Render every registered chart from the prepared reports ({dimensions: frame}); a failing
+    # chart is logged and skipped without aborting the others. Charts whose input didn't change
+    # since an earlier run are copied from the chart cache instead. on_chart(name, result) is
+    # called as soon as each chart is ready, e.g. to bundle it while the others still render.
+    # Returns {filename: path}, or {filename: PNG bytes} when workdir is None.
+    rendered, pending, cached_now = {}, {}, []
+    def done(name, result, key=None):
+        rendered[name] = result
+        if key and write_cached_chart(CHART_CACHE_DIR, key, result):
+            cached_now.append(name)
+        if on_chart:
+            on_chart(name, result)
+    for name, spec in CHARTS.items():
+        try:
+            data = chart_input(spec, frames)
+            path = workdir and os.path.join(workdir, name)
+            key = CHART_CACHE_DIR and chart_cache_key(spec, data)
+            cached = key and read_cached_chart(CHART_CACHE_DIR, key, name, path)
+            if cached:
+                done(name, cached)
+            else:
+                pending[name] = (spec, data, path, key)
+        except Exception as e:
+            logging.error("Error preparing chart '%s': %s", name, e)
+    if pending:
+        # Profiled charts render in-process, where the profiler sees them
+        if workers <= 1 or PROFILE_STAGE == 'render':
+            apply_chart_style()
+            for name, (spec, data, path, key) in pending.items():
+                try:
+                    done(name, render_chart(name, data, path), key)
+                except Exception as e:
+                    logging.error("Error rendering chart '%s': %s", name, e)
+        else:
+            # Spawned, not forked: the ZIP writer thread may hold a lock (e.g. _spans_lock) at fork time,
+            # which a forked worker would inherit locked and deadlock on
+            with ProcessPoolExecutor(max_workers=min(workers, len(pending)), mp_context=multiprocessing.get_context('spawn'),
+                                     initializer=_init_chart_worker) as executor:
+                futures = {name: executor.submit(_render_chart_in_worker, spec, data, path) for name, (spec, data, path, key) in pending.items()}
+                for name, future in futures.items():
+                    try:
+                        result, spans = future.result()
+                        record_spans(spans)
+                        done(name, result, pending[name][3])
+                    except Exception as e:
+                        logging.error("Error rendering chart '%s': %s", name, e)
+        # Only charts cached in this call can have grown the cache past its limit
+        if cached_now:
+            try:
+                evict_lru(CHART_CACHE_DIR, CHART_CACHE_MAX_BYTES)
+            except Exception as e:
+                logging.warning("Error evicting chart cache: %s", e)
+    return {name: rendered[name] for name in CHARTS if name in rendered}
+
+def plot_data(workdir='.', chart_workers=CHART_WORKERS, on_chart=None):
     try:
-        if os.path.exists('data_by_month.csv') and os.path.exists('data_by_channel.csv'):
-            # Ensure seaborn and matplotlib are configured for plotting
-            sns.set_theme(style="whitegrid")
-            plt.rc('axes', axisbelow=True)
-            
+        report_files = {filename: os.path.join(workdir, filename) for _, _, filename in REPORTS}
+        if all(os.path.exists(path) for path in report_files.values()):
             # Load the data from CSVs
-            data_by_month = pd.read_csv('data_by_month.csv')
-            data_by_channel = pd.read_csv('data_by_channel.csv')
-            
-            # Process data for plotting
-            top_channels_installs = data_by_channel[~data_by_channel['channel'].str.contains("Organic", case=False)]
-            top_channels_installs = top_channels_installs.sort_values(by='installs', ascending=False).head(5)
-            top_channels_sessions = data_by_channel[~data_by_channel['channel'].str.contains("Organic", case=False)]
-            top_channels_sessions = top_channels_sessions.sort_values(by='sessions', ascending=False).head(5)
-            data_by_channel['rejected_attributions'] = data_by_channel['rejected_installs'] + data_by_channel['rejected_reattributions']
-            top_channels_rejected_attributions = data_by_channel[~data_by_channel['channel'].str.contains("Organic", case=False)]
-            top_channels_rejected_attributions = top_channels_rejected_attributions.sort_values(by='rejected_attributions', ascending=False).head(5)
-            data_by_month['month'] = pd.to_datetime(data_by_month['month'], format='%Y-%m')  # Convert month to datetime for proper sorting
-            data_by_month.sort_values('month', inplace=True)  # Sort data by month
-            data_by_month['month'] = data_by_month['month'].dt.strftime('%b/%y')
-            data_by_month['total_attributions'] = data_by_month['installs'] + data_by_month['reattributions']
-            data_by_month['percent_installs'] = data_by_month['installs'] / data_by_month['total_attributions'] * 100  # Convert installs to percentage of the total attributions
-            data_by_month['percent_reattributions'] = data_by_month['reattributions'] / data_by_month['total_attributions'] * 100  # Convert reattributions to percentage of the total attributions
-            data_by_month['organic_installs'] = data_by_month['installs'] * data_by_month['organic_install_rate']
-            data_by_month['paid_installs'] = data_by_month['installs'] - data_by_month['organic_installs']
-
-            # PLOT 1: Monthly Installs and Reattributions (Percentage) ----------------------------------------------------------------------------
-            # Set the figure size for percentage plot
-            plt.figure(figsize=(14, 7))
-
-            # Bar chart for installs (percentage)
-            bar1 = sns.barplot(x="month", y="percent_installs", data=data_by_month, color='darkblue', label='Installs')
-
-            # Bar chart for reattributions (percentage), stacked
-            bar2 = sns.barplot(x="month", y="percent_reattributions", data=data_by_month, bottom=data_by_month['percent_installs'], color='lightblue', label='Reattributions')
-
-            # Add labels to each section (percentage plot)
-            for i in range(len(data_by_month)):
-                plt.text(i, data_by_month['percent_installs'][i]/2, f"{data_by_month['percent_installs'][i]:.1f}%", ha='center', va='center', color='white', fontweight='bold')
-                plt.text(i, data_by_month['percent_installs'][i] + data_by_month['percent_reattributions'][i]/2, f"{data_by_month['percent_reattributions'][i]:.1f}%", ha='center', va='center', color='black', fontweight='bold')
-
-            # Add legend and move it to avoid overlay (percentage plot)
-            plt.legend(title="Metric", loc='upper left', bbox_to_anchor=(1, 1))
-
-            # Adding labels for clarity with bold font (percentage plot)
-            plt.xlabel('Month', fontweight='bold')
-            plt.ylabel('Percentage', fontweight='bold')
-            plt.title('Monthly Installs and Reattributions (Percentage)', fontweight='bold')
-
-            # Save the plot as a PNG file (percentage plot)
-            plt.savefig('percent_installsxreattributions_by_month.png', bbox_inches='tight')
-
-            # PLOT 2: Monthly Installs and Reattributions (Absolute Values) ----------------------------------------------------------------------------
-            # Set the figure size for absolute values plot
-            plt.figure(figsize=(14, 7))
-
-            # Bar chart for installs (absolute values)
-            bar3 = sns.barplot(x="month", y="installs", data=data_by_month, color='darkblue', label='Installs')
-
-            # Bar chart for reattributions (absolute values), stacked
-            bar4 = sns.barplot(x="month", y="reattributions", data=data_by_month, bottom=data_by_month['installs'], color='lightblue', label='Reattributions')
-
-            # Add labels to each section (absolute values plot)
-            for i in range(len(data_by_month)):
-                install_height = data_by_month.iloc[i]['installs']
-                reattrib_height = data_by_month.iloc[i]['reattributions']
-                total_height = install_height + reattrib_height
-                # Label for installs
-                plt.text(i, install_height/2, f"{install_height:,.0f}", ha='center', va='center', color='white', fontweight='bold')
-                # Label for reattributions
-                plt.text(i, install_height + reattrib_height/2, f"{reattrib_height:,.0f}", ha='center', va='center', color='black', fontweight='bold')
-
-            # Add legend and move it to avoid overlay (absolute values plot)
-            plt.legend(title="Metric", loc='upper left', bbox_to_anchor=(1, 1))
-
-            # Adding labels for clarity with bold font (absolute values plot)
-            plt.xlabel('Month', fontweight='bold')
-            plt.ylabel('Count', fontweight='bold')
-            plt.title('Monthly Installs and Reattributions (Absolute Values)', fontweight='bold')
-
-            # Save the plot as a PNG file (absolute values plot)
-            plt.savefig('absolute_installsxreattributions_by_month.png', bbox_inches='tight')
-
-            # PLOT 3: Monthly Paid Installs and Organic Installs (Absolute Values) ----------------------------------------------------------------------------
-            # Set the figure size for absolute values plot
-            plt.figure(figsize=(14, 7))
-
-            # Bar chart for organic installs (absolute values)
-            bar5 = sns.barplot(x="month", y="organic_installs", data=data_by_month, color='lightblue', label='Organic Installs')
-
-            # Bar chart for paid installs (absolute values), stacked
-            bar6 = sns.barplot(x="month", y="paid_installs", data=data_by_month, bottom=data_by_month['organic_installs'], color='darkblue', label='Paid Installs')
-
-            # Add labels to each section (absolute values plot)
-            for i in range(len(data_by_month)):
-                org_install_height = data_by_month.iloc[i]['organic_installs']
-                paid_install_height = data_by_month.iloc[i]['paid_installs']
-                total_height = org_install_height + paid_install_height
-                # Label for paid installs
-                plt.text(i, org_install_height/2, f"{org_install_height:,.0f}", ha='center', va='center', color='black', fontweight='bold')
-                # Label for organic installs
-                plt.text(i, org_install_height + paid_install_height/2, f"{paid_install_height:,.0f}", ha='center', va='center', color='white', fontweight='bold')
-
-            # Add legend and move it to avoid overlay (absolute values plot)
-            plt.legend(title="Metric", loc='upper left', bbox_to_anchor=(1, 1))
-
-            # Adding labels for clarity with bold font (absolute values plot)
-            plt.xlabel('Month', fontweight='bold')
-            plt.ylabel('Count', fontweight='bold')
-            plt.title('Monthly Paid Installs and Organic Installs (Absolute Values)', fontweight='bold')
-
-            # Save the plot as a PNG file (absolute values plot)
-            plt.savefig('absolute_paidinstallsxorganicinstalls_by_month.png', bbox_inches='tight')
-
-            # PLOT 4: Monthly Paid Installs (Absolute Values) --------------------------------------------------------------------------------------------
-            # Set the figure size for absolute values plot
-            plt.figure(figsize=(14, 7))
-
-            # Bar chart for paid installs (absolute values)
-            bar7 = sns.barplot(x="month", y="paid_installs", data=data_by_month, color='darkblue', label='Paid Installs')
-
-            # Add labels to each section (absolute values plot)
-            for i in range(len(data_by_month)):
-                paid_install_height = data_by_month.iloc[i]['paid_installs']
-                # Label for paid installs
-                plt.text(i, paid_install_height / 2, f"{paid_install_height:,.0f}", ha='center', va='center', color='white', fontweight='bold')
-
-            # Add legend and move it to avoid overlay (absolute values plot)
-            plt.legend(title="Metric", loc='upper left', bbox_to_anchor=(1, 1))
-
-            # Adding labels for clarity with bold font (absolute values plot)
-            plt.xlabel('Month', fontweight='bold')
-            plt.ylabel('Count', fontweight='bold')
-            plt.title('Monthly Paid Installs (Absolute Values)', fontweight='bold')
-
-            # Save the plot as a PNG file (absolute values plot)
-            plt.savefig('absolute_paidinstalls_by_month.png', bbox_inches='tight')
-
-            # PLOT 5: Top 5 installs by channel (Absolute Values) --------------------------------------------------------------------------------------------
-            # Set the figure size for absolute values plot
-            plt.figure(figsize=(14, 7))
-
-            # Bar chart for installs by channel (absolute values)
-            bar8 = sns.barplot(x="channel", y="installs", data=top_channels_installs, color='darkblue', label='Channel')
-
-            # Add labels to each section (absolute values plot)
-            for i, row in enumerate(top_channels_installs.itertuples()):
-                label_position = row.installs / 2 if row.installs > 0 else 0.1 * max(top_channels_installs['installs'])
-                # Ensure the label is visible even for very small values
-                label_text = f"{row.installs:,.0f}" if row.installs > 0 else "<0.1"
-                plt.text(i, label_position, label_text, ha='center', va='center', color='white', fontweight='bold')
-
-            # Add legend and move it to avoid overlay (absolute values plot)
-            plt.legend(title="Metric", loc='upper left', bbox_to_anchor=(1, 1))
-
-            # Adding labels for clarity with bold font (absolute values plot)
-            plt.xlabel('Channel', fontweight='bold')
-            plt.ylabel('Installs', fontweight='bold')
-            plt.title('Top 5 Installs by Channel (Excluding Organic)', fontweight='bold')
-
-            # Save the plot as a PNG file (absolute values plot)
-            plt.savefig('top_installs_by_channel.png', bbox_inches='tight')
-
-            # PLOT 6: Top 5 sessions by channel (Absolute Values) --------------------------------------------------------------------------------------------
-            # Set the figure size for absolute values plot
-            plt.figure(figsize=(14, 7))
-
-            # Bar chart for sessions by channel (absolute values)
-            bar9 = sns.barplot(x="channel", y="sessions", data=top_channels_sessions, color='darkblue', label='Channel')
-
-            # Add labels to each section (absolute values plot)
-            for i, row in enumerate(top_channels_sessions.itertuples()):
-                label_position = row.sessions / 2 if row.sessions > 0 else 0.1 * max(top_channels_sessions['sessions'])
-                # Ensure the label is visible even for very small values
-                label_text = f"{row.sessions:,.0f}" if row.sessions > 0 else "<0.1"
-                plt.text(i, label_position, label_text, ha='center', va='center', color='white', fontweight='bold')
-
-            # Add legend and move it to avoid overlay (absolute values plot)
-            plt.legend(title="Metric", loc='upper left', bbox_to_anchor=(1, 1))
-
-            # Adding labels for clarity with bold font (absolute values plot)
-            plt.xlabel('Channel', fontweight='bold')
-            plt.ylabel('Sessions', fontweight='bold')
-            plt.title('Top 5 Sessions by Channel (Excluding Organic)', fontweight='bold')
-
-            # Save the plot as a PNG file (absolute values plot)
-            plt.savefig('top_sessions_by_channel.png', bbox_inches='tight')
-
-            # PLOT 7: MAUs by month (Absolute Values) --------------------------------------------------------------------------------------------
-            # Set the figure size for absolute values plot
-            plt.figure(figsize=(14, 7))
-
-            # Line chart for MAUs by month (absolute values)
-            line = sns.lineplot(x="month", y="maus", data=data_by_month, marker='o', color='darkblue', label='MAUs', markersize=8)
-
-            # Add labels to each point on the line plot
-            for i, row in enumerate(data_by_month.itertuples()):
-                # Position labels above each marker
-                plt.text(i, row.maus + 0.02 * max(data_by_month['maus']), f"{row.maus:,.0f}", ha='center', va='bottom', color='black', fontweight='bold')
-
-            # Customize grid lines
-            plt.grid(True)
-            plt.gca().grid(which='major', axis='y', linestyle='-', linewidth='0.5', color='gray')  # Enable only horizontal lines
-            plt.gca().grid(which='major', axis='x', visible=False)  # Disable vertical lines
-
-            # Add legend and move it to avoid overlay (absolute values plot)
-            plt.legend(title="Metric", loc='upper left', bbox_to_anchor=(1, 1))
-
-            # Adding labels for clarity with bold font (absolute values plot)
-            plt.xlabel('Month', fontweight='bold')
-            plt.ylabel('MAUs', fontweight='bold')
-            plt.title('MAUs by Month', fontweight='bold')
-
-            # Save the plot as a PNG file (absolute values plot)
-            plt.savefig('maus_by_month.png', bbox_inches='tight')
-
-            # PLOT 8: Monthly Rejected Installs and Rejected Reattributions (Absolute Values) ----------------------------------------------------------------------------
-            # Set the figure size for absolute values plot
-            plt.figure(figsize=(14, 7))
-
-            # Bar chart for rejected reattributions (absolute values)
-            bar10 = sns.barplot(x="month", y="rejected_reattributions", data=data_by_month, color='lightblue', label='Rejected Reattributions')
-
-            # Bar chart for rejected installs (absolute values), stacked
-            bar11 = sns.barplot(x="month", y="rejected_installs", data=data_by_month, bottom=data_by_month['rejected_reattributions'], color='darkblue', label='Rejected Installs')
-
-            # Add labels to each section (absolute values plot)
-            for i in range(len(data_by_month)):
-                rejected_reattributions_height = data_by_month.iloc[i]['rejected_reattributions']
-                rejected_installs_height = data_by_month.iloc[i]['rejected_installs']
-                total_height = rejected_reattributions_height + rejected_installs_height
-                # Label for rejected reattributions
-                plt.text(i, rejected_reattributions_height/2, f"{rejected_reattributions_height:,.0f}", ha='center', va='center', color='black', fontweight='bold')
-                # Label for rejected installs
-                plt.text(i, rejected_reattributions_height + rejected_installs_height/2, f"{rejected_installs_height:,.0f}", ha='center', va='center', color='white', fontweight='bold')
-
-            # Add legend and move it to avoid overlay (absolute values plot)
-            plt.legend(title="Metric", loc='upper left', bbox_to_anchor=(1, 1))
-
-            # Adding labels for clarity with bold font (absolute values plot)
-            plt.xlabel('Month', fontweight='bold')
-            plt.ylabel('Count', fontweight='bold')
-            plt.title('Monthly Rejected Attributions', fontweight='bold')
-
-            # Save the plot as a PNG file (absolute values plot)
-            plt.savefig('absolute_rejected_attributions_by_month.png', bbox_inches='tight')
-
-            # PLOT 9: Rejected Attributions (Installs and Reattributions) by Channel (Absolute Values) ----------------------------------------------------------------------------
-            # Set the figure size for absolute values plot
-            plt.figure(figsize=(14, 7))
-
-            # Bar chart for rejected attributions (absolute values)
-            bar12 = sns.barplot(x="channel", y="rejected_attributions", data=top_channels_rejected_attributions, color='darkblue', label='Channel')
-
-            # Add labels to each section (absolute values plot)
-            for i, row in enumerate(top_channels_rejected_attributions.itertuples()):
-                label_position = row.rejected_attributions / 2 if row.rejected_attributions > 0 else 0.1 * max(top_channels_rejected_attributions['rejected_attributions'])
-                # Ensure the label is visible even for very small values
-                label_text = f"{row.rejected_attributions:,.0f}" if row.rejected_attributions > 0 else "<0.1"
-                plt.text(i, label_position, label_text, ha='center', va='center', color='white', fontweight='bold')
-
-            # Add legend and move it to avoid overlay (absolute values plot)
-            plt.legend(title="Metric", loc='upper left', bbox_to_anchor=(1, 1))
-
-            # Adding labels for clarity with bold font (absolute values plot)
-            plt.xlabel('Channel', fontweight='bold')
-            plt.ylabel('Rejected Attributions', fontweight='bold')
-            plt.title('Top 5 Rejected Attributions by Channel (Installs + Reattributions)', fontweight='bold')
-
-            # Save the plot as a PNG file (absolute values plot)
-            plt.savefig('top_rejected_attributions_by_channel.png', bbox_inches='tight')
-
-            # PLOT 10: Monthly Sessions and Revenue Events (Absolute Values) ----------------------------------------------------------------------------
-            # Set the figure size for absolute values plot
-            plt.figure(figsize=(14, 7))
-
-            # Bar chart for revenue events (absolute values)
-            bar13 = sns.barplot(x="month", y="revenue_events", data=data_by_month, color='lightblue', label='Revenue Events')
-
-            # Bar chart for sessions (absolute values), stacked
-            bar14 = sns.barplot(x="month", y="sessions", data=data_by_month, bottom=data_by_month['revenue_events'], color='darkblue', label='Sessions')
-
-            # Add labels to each section (absolute values plot)
-            for i in range(len(data_by_month)):
-                revenue_events_height = data_by_month.iloc[i]['revenue_events']
-                sessions_height = data_by_month.iloc[i]['sessions']
-                total_height = revenue_events_height + sessions_height
-                # Label for revenue events
-                plt.text(i, revenue_events_height/2, f"{revenue_events_height:,.0f}", ha='center', va='center', color='black', fontweight='bold')
-                # Label for sessions
-                plt.text(i, revenue_events_height + sessions_height/2, f"{sessions_height:,.0f}", ha='center', va='center', color='white', fontweight='bold')
-
-            # Add legend and move it to avoid overlay (absolute values plot)
-            plt.legend(title="Metric", loc='upper left', bbox_to_anchor=(1, 1))
-
-            # Adding labels for clarity with bold font (absolute values plot)
-            plt.xlabel('Month', fontweight='bold')
-            plt.ylabel('Count', fontweight='bold')
-            plt.title('Monthly Sessions and Revenue Events', fontweight='bold')
-
-            # Save the plot as a PNG file (absolute values plot)
-            plt.savefig('absolute_sessions_revevents_by_month.png', bbox_inches='tight')
-
-            # PLOT 11: Monthly Clicks and Impressions (Absolute Values) ----------------------------------------------------------------------------
-            # Set the figure size for absolute values plot
-            plt.figure(figsize=(14, 7))
-
-            # Bar chart for revenue events (absolute values)
-            bar13 = sns.barplot(x="month", y="clicks", data=data_by_month, color='darkblue', label='Clicks')
-
-            # Bar chart for sessions (absolute values), stacked
-            bar14 = sns.barplot(x="month", y="impressions", data=data_by_month, bottom=data_by_month['clicks'], color='lightblue', label='Impressions')
-
-            # Add labels to each section (absolute values plot)
-            for i in range(len(data_by_month)):
-                clicks_height = data_by_month.iloc[i]['clicks']
-                impression_height = data_by_month.iloc[i]['impressions']
-                total_height = clicks_height + impression_height
-                # Label for revenue events
-                plt.text(i, clicks_height/2, f"{clicks_height:,.0f}", ha='center', va='center', color='white', fontweight='bold')
-                # Label for sessions
-                plt.text(i, clicks_height + impression_height/2, f"{impression_height:,.0f}", ha='center', va='center', color='black', fontweight='bold')
-
-            # Add legend and move it to avoid overlay (absolute values plot)
-            plt.legend(title="Metric", loc='upper left', bbox_to_anchor=(1, 1))
-
-            # Adding labels for clarity with bold font (absolute values plot)
-            plt.xlabel('Month', fontweight='bold')
-            plt.ylabel('Count', fontweight='bold')
-            plt.title('Monthly Clicks and Impressions', fontweight='bold')
-
-            # Save the plot as a PNG file (absolute values plot)
-            plt.savefig('absolute_clicks_impressions_by_month.png', bbox_inches='tight')
+            charts = list(render_charts(load_reports(report_files), workdir, chart_workers, on_chart).values())
+            flush_metrics(workdir)
+            return charts
         else:
             logging.error("Data files not found. Ensure API request was successful.")
     except Exception as e:
         logging.error("Error during plotting: %s", e)
+    return []
 
-if __name__ == "__main__":
-    api_token, app_tokens = get_tokens()
-    if api_token:
+# Instrumentation functions
+def peak_rss_mb():
+    # Peak resident memory of this process so far (ru_maxrss is KB on Linux, bytes on macOS)
+    try:
+        import resource
+    except ImportError:
+        return None  # Not available on Windows
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+@contextlib.contextmanager
+def span(stage, name, **details):
+    # Record one pipeline step: wall time, CPU time of the calling thread and peak memory of the
+    # process (and how much this step raised it). The caller can add details, e.g. bytes received.
+    global _profile_stats
+    profile = None
+    if stage == PROFILE_STAGE and not getattr(_profiling, 'active', False):
+        import cProfile
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+            _profiling.active = True
+        except ValueError:
+            profile = None  # Python 3.12+ allows one profiler at a time, which then sees every thread
+    rss_before = peak_rss_mb()
+    wall, cpu = time.perf_counter(), time.thread_time()
+    try:
+        yield details
+    finally:
+        wall, cpu = time.perf_counter() - wall, time.thread_time() - cpu
+        if profile:
+            profile.disable()
+            _profiling.active = False
+            import pstats
+            with _spans_lock:
+                _profile_stats = pstats.Stats(profile) if _profile_stats is None else _profile_stats.add(profile)
+        rss_after = peak_rss_mb()
+        record_spans([{
+            'stage': stage, 'span': name, 'wall_seconds': round(wall, 4), 'cpu_seconds': round(cpu, 4),
+            'peak_rss_mb': rss_after, 'rss_growth_mb': round(rss_after - rss_before, 1) if rss_after is not None else None,
+            'details': json.dumps(details) if details else '',
+        }])
+
+def record_spans(spans):
+    with _spans_lock:
+        _spans.extend(spans)
+
+def take_spans():
+    # Spans recorded since the last call, in the order they finished
+    with _spans_lock:
+        spans = _spans[:]
+        _spans.clear()
+    return spans
+
+def flush_metrics(workdir, fresh=False):
+    # Hand this stage's spans (and profile) to the next stage through the workdir;
+    # fresh starts a new metrics file for a new run
+    path = os.path.join(workdir, METRICS_FILE)
+    new_file = fresh or not os.path.exists(path)
+    with open(path, 'w' if new_file else 'a', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=METRICS_FIELDS)
+        if new_file:
+            writer.writeheader()
+        writer.writerows(take_spans())
+    save_profile(workdir)
+
+def save_profile(directory):
+    global _profile_stats
+    if _profile_stats is not None:
+        profile_file = os.path.join(directory, f"{PROFILE_STAGE}.prof")
+        _profile_stats.dump_stats(profile_file)
+        _profile_stats = None
+        logging.info(f"Profile of the '{PROFILE_STAGE}' stage saved to '{profile_file}' (open it with python3 -m pstats)")
+
+def add_metrics(output_zip, workdir=None):
+    # Append metrics.csv to the bundle, next to audit_trail.csv: the spans earlier stages left
+    # in workdir followed by the ones recorded here, which include zipping the other files
+    spans = []
+    if workdir and os.path.exists(os.path.join(workdir, METRICS_FILE)):
+        with open(os.path.join(workdir, METRICS_FILE), newline='') as file:
+            spans = list(csv.DictReader(file))
+        os.remove(os.path.join(workdir, METRICS_FILE))
+    spans.extend(take_spans())
+    text = io.StringIO()
+    writer = csv.DictWriter(text, fieldnames=METRICS_FIELDS, lineterminator='\n')
+    writer.writeheader()
+    writer.writerows(spans)
+    if hasattr(output_zip, 'seek'):
+        output_zip.seek(0)
+    with zipfile.ZipFile(output_zip, 'a', zipfile.ZIP_DEFLATED, compresslevel=ZIP_COMPRESS_LEVEL) as zipf:
+        zipf.writestr(METRICS_FILE, text.getvalue())
+    if METRICS_STDOUT:
+        print_metrics(spans)
+
+def print_metrics(spans):
+    print(f"{'stage':<8} {'span':<60} {'wall s':>8} {'cpu s':>8} {'peak MB':>8}  details")
+    for entry in spans:
+        print(f"{entry['stage']:<8} {entry['span']:<60} {float(entry['wall_seconds']):>8.3f} {float(entry['cpu_seconds']):>8.3f} {entry['peak_rss_mb'] or '':>8}  {entry['details']}")
+
+# Pipeline functions
+def write_audit_trail(api_token, urls, filename):
+    with span('audit', "audit trail", entries=len(urls)), open_output(filename, 'w', newline='') as csvfile:
+        audit_writer = csv.writer(csvfile)
+        audit_writer.writerow(['Request Header', 'Requested URL'])
+        for url in urls:
+            # Entries not requested in this run carry their own header, e.g. served from history
+            audit_writer.writerow(url if isinstance(url, tuple) else ['API Token: Bearer ' + api_token, url])
+    logging.info(f"Audit trail saved to '{filename}'" if isinstance(filename, str) else "Audit trail written in memory")
+
+def fetch_stage(api_token, app_tokens, utc_offset, start_date, end_date, workdir='.', history_db=HISTORY_DB):
+    # Fetch stage: write the reports and the audit trail into workdir, where the render
+    # and bundle stages pick them up. Returns the written files, or None on failure.
+    date_period = format_date_period(start_date, end_date)
+    if not date_period:
+        return None
+    os.makedirs(workdir, exist_ok=True)
+    take_spans()  # Drop spans left over by an earlier run in this process
+    with create_session() as session:
+        results = fetch_reports(api_token, app_tokens, utc_offset, start_date, end_date, session=session, workdir=workdir, history_db=history_db)
+    if not all(results):
+        logging.error("Not all reports could be fetched, skipping plots and bundle.")
+        return None
+    urls = [url for report_urls in results for url in report_urls]
+    try:
+        audit_file = os.path.join(workdir, 'audit_trail.csv')
+        write_audit_trail(api_token, urls, audit_file)
+    except Exception as e:
+        logging.error("Error writing audit trail: %s", e)
+        return None
+    flush_metrics(workdir, fresh=True)
+    return [os.path.join(workdir, filename) for _, _, filename in REPORTS] + [audit_file]
+
+def bundle_stage(workdir='.', output_zip='qbr_outputs.zip'):
+    # Bundle stage: zip the reports, audit trail and charts the other stages left in workdir
+    try:
+        files_to_zip = [os.path.join(workdir, filename) for _, _, filename in REPORTS] + [os.path.join(workdir, 'audit_trail.csv')] + [os.path.join(workdir, filename) for filename in CHARTS]
+        zip_outputs(files_to_zip, output_zip)
+        add_metrics(output_zip, workdir)
+        return output_zip
+    except Exception as e:
+        logging.error("Failed during zipping: %s", e)
+        return None
+
+def run_qbr(api_token, app_tokens, utc_offset, start_date, end_date, workdir='.', output_zip='qbr_outputs.zip', chart_workers=CHART_WORKERS, history_db=HISTORY_DB):
+    # Fetch, plot and bundle one QBR; every intermediate file lives in workdir. The reports and
+    # audit trail are compressed while the charts render, and each chart is bundled once drawn.
+    fetched = fetch_stage(api_token, app_tokens, utc_offset, start_date, end_date, workdir, history_db)
+    if not fetched:
+        return None
+    try:
+        with open_bundle(output_zip) as add:
+            for file in fetched:
+                add(file)  # Charts are still rendered from the reports, they are removed below
+            plot_data(workdir, chart_workers, on_chart=lambda name, path: add(path, remove=True))
+        for file in fetched:
+            os.remove(file)
+        add_metrics(output_zip, workdir)
+        return output_zip
+    except Exception as e:
+        logging.error("Failed during zipping: %s", e)
+        return None
+
+def run_qbr_in_memory(api_token, app_tokens, utc_offset, start_date, end_date, output_zip='qbr_outputs.zip', chart_workers=CHART_WORKERS, history_db=HISTORY_DB, session=None):
+    # Same QBR as run_qbr, but reports go straight into DataFrames, charts render into
+    # buffers and everything is written directly into the ZIP (a path or a binary buffer):
+    # no intermediate file touches the working directory. A given session is left open.
+    date_period = format_date_period(start_date, end_date)
+    if not date_period:
+        return None
+    buffers = {filename: io.BytesIO() for _, _, filename in REPORTS}
+    take_spans()  # Drop spans left over by an earlier run in this process
+    with contextlib.nullcontext(session) if session else create_session() as session:
+        results = fetch_reports(api_token, app_tokens, utc_offset, start_date, end_date, session=session, destinations=buffers, history_db=history_db)
+    if not all(results):
+        logging.error("Not all reports could be fetched, skipping plots and bundle.")
+        return None
+    urls = [url for report_urls in results for url in report_urls]
+    try:
+        # Reports and audit trail are compressed while the charts render, each chart is bundled once drawn
+        with open_bundle(output_zip) as add:
+            for filename, buffer in buffers.items():
+                add(filename, buffer.getvalue())
+            audit = io.StringIO()
+            write_audit_trail(api_token, urls, audit)
+            add('audit_trail.csv', audit.getvalue().encode())
+            try:
+                render_charts(load_reports(buffers), None, chart_workers, on_chart=add)
+            except Exception as e:
+                logging.error("Error during plotting: %s", e)
+        add_metrics(output_zip)
+        save_profile('.')  # Without a workdir the profile goes to the current directory
+        return output_zip
+    except Exception as e:
+        logging.error("Failed during zipping: %s", e)
+        return None
+
+# Batch mode functions
+def load_manifest(path):
+    # A manifest is a JSON list of objects or a CSV with a header row. Each job needs
+    # api_token, app_tokens ("all" or space separated), utc_offset and either
+    # date_range (YYYY-MM-DD/YYYY-MM-DD) or start_date/end_date; output names the ZIP.
+    # Rows are only validated when their job runs, so one bad row fails that job alone.
+    with open(path, newline='') as file:
+        if path.lower().endswith('.json'):
+            rows = json.load(file)
+        else:
+            rows = list(csv.DictReader(file))
+    jobs, names = [], set()
+    for index, row in enumerate(rows, start=1):
+        output = row.get('output') if isinstance(row, dict) else None
+        output = os.path.basename(str(output or f"qbr_{index}"))
+        name = output[:-4] if output.endswith('.zip') else output
+        job = {'name': name, 'row': row}
+        if name in names:
+            # Two jobs with the same name would overwrite each other's ZIP
+            job['error'] = f"Duplicate output name '{name}' in manifest row {index}."
+            job['name'] = f"{name} (row {index})"
+        names.add(name)
+        jobs.append(job)
+    return jobs
+
+def parse_manifest_row(row):
+    if not isinstance(row, dict):
+        raise ValueError("Manifest row is not an object.")
+    api_token = row.get('api_token')
+    if not api_token:
+        raise ValueError("Missing API token.")
+    app_tokens = row.get('app_tokens') or 'all'
+    if isinstance(app_tokens, str):
+        app_tokens = None if app_tokens.strip().lower() == 'all' else app_tokens.split()
+    utc_offset = row.get('utc_offset') or ''
+    if not re.match(UTC_OFFSET_PATTERN, utc_offset):
+        raise ValueError("Invalid UTC offset format.")
+    start_date, end_date = row.get('start_date'), row.get('end_date')
+    if row.get('date_range'):
+        try:
+            start_date, end_date = row['date_range'].split('/')
+        except ValueError:
+            raise ValueError(f"Invalid date range '{row['date_range']}', expected YYYY-MM-DD/YYYY-MM-DD.")
+    if not (start_date and end_date):
+        raise ValueError("Missing date range.")
+    if datetime.strptime(start_date, '%Y-%m-%d') > datetime.strptime(end_date, '%Y-%m-%d'):
+        raise ValueError("Start date is after end date.")
+    return api_token, app_tokens, utc_offset, start_date, end_date
+
+def _init_batch_worker(api_slots, breakdowns=(), chart_cache_dir=CHART_CACHE_DIR, compress_level=ZIP_COMPRESS_LEVEL):
+    global _api_slots, CHART_CACHE_DIR, ZIP_COMPRESS_LEVEL
+    _api_slots = api_slots
+    CHART_CACHE_DIR = chart_cache_dir
+    ZIP_COMPRESS_LEVEL = compress_level
+    # Spawned workers start from the module's own reports and charts
+    for breakdown in breakdowns:
+        register_breakdown(**breakdown)
+
+def run_batch_job(job, output_dir, in_memory=False, history_db=HISTORY_DB):
+    # Each job runs in its own workspace (or fully in memory) so parallel jobs never clobber each other's files
+    try:
+        if job.get('error'):
+            raise ValueError(job['error'])
+        api_token, app_tokens, utc_offset, start_date, end_date = parse_manifest_row(job['row'])
+        output_zip = os.path.join(output_dir, f"{job['name']}.zip")
+        if in_memory:
+            if run_qbr_in_memory(api_token, app_tokens, utc_offset, start_date, end_date, output_zip, chart_workers=1, history_db=history_db):
+                return True, output_zip
+            return False, "QBR run failed, see log for details"
+        workspace = tempfile.mkdtemp(prefix=f"{job['name']}-", dir=output_dir)
+        try:
+            # Jobs already run in parallel, so each one renders its charts in-process
+            if run_qbr(api_token, app_tokens, utc_offset, start_date, end_date, workspace, output_zip, chart_workers=1, history_db=history_db):
+                return True, output_zip
+            return False, "QBR run failed, see log for details"
+        finally:
+            shutil.rmtree(workspace, ignore_errors=True)
+    except Exception as e:
+        logging.error("Batch job '%s' failed: %s", job['name'], e)
+        return False, str(e)
+
+def run_batch(manifest, output_dir='.', workers=BATCH_WORKERS, api_concurrency=BATCH_API_CONCURRENCY, in_memory=False, history_db=HISTORY_DB, breakdowns=()):
+    # breakdowns: register_breakdown arguments of extra top-N charts, added to every job
+    jobs = load_manifest(manifest)
+    os.makedirs(output_dir, exist_ok=True)
+    api_slots = multiprocessing.BoundedSemaphore(api_concurrency)
+    results = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_batch_worker, initargs=(api_slots, breakdowns, CHART_CACHE_DIR, ZIP_COMPRESS_LEVEL)) as executor:
+        futures = [executor.submit(run_batch_job, job, output_dir, in_memory, history_db) for job in jobs]
+        for job, future in zip(jobs, futures):
+            try:
+                ok, detail = future.result()
+            except Exception as e:
+                ok, detail = False, str(e)
+            results.append((job['name'], ok, detail))
+    # Per-job summary
+    succeeded = sum(1 for _, ok, _ in results if ok)
+    logging.info(f"Batch finished: {succeeded}/{len(results)} QBRs generated")
+    for name, ok, detail in results:
+        if ok:
+            logging.info(f"  OK      {name}: {detail}")
+        else:
+            logging.error(f"  FAILED  {name}: {detail}")
+    return results
+
+# Service mode functions
+def _init_service_worker(api_slots, breakdowns=(), chart_cache_dir=CHART_CACHE_DIR, compress_level=ZIP_COMPRESS_LEVEL):
+    # Pay for the heavy imports, the chart style and the connection pool once per worker, not per QBR
+    global _service_session
+    import pandas  # noqa: F401
+    _init_batch_worker(api_slots, breakdowns, chart_cache_dir, compress_level)
+    _init_chart_worker()
+    _service_session = create_session()
+
+def _service_worker_ready():
+    return os.getpid()
+
+def run_service_job(query, history_db=HISTORY_DB):
+    # One QBR in a warm worker, rendered in-process and zipped in memory; the ZIP bytes, or None
+    output = io.BytesIO()
+    if run_qbr_in_memory(*query, output, chart_workers=1, history_db=history_db, session=_service_session):
+        return output.getvalue()
+    return None
+
+def create_service(executor, host=SERVICE_HOST, port=SERVICE_PORT, capacity=SERVICE_WORKERS + SERVICE_QUEUE_SIZE, history_db=HISTORY_DB):
+    # HTTP front of the worker pool. POST /qbr takes a JSON object with the manifest fields
+    # (api_token, app_tokens, utc_offset, date_range) and answers with the QBR's ZIP archive.
+    # At most `capacity` QBRs are running or queued; further requests get 503 right away.
+    import http.server
+    slots = threading.BoundedSemaphore(capacity)
+    jobs = [0]  # Running or queued, for GET /health
+    jobs_lock = threading.Lock()
+
+    class QBRRequestHandler(http.server.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            if self.path != '/health':
+                return self.send_json(404, {'error': "Not found"})
+            self.send_json(200, {'status': 'ok', 'jobs': jobs[0], 'capacity': capacity})
+
+        def do_POST(self):
+            if self.path != '/qbr':
+                return self.send_json(404, {'error': "Not found"})
+            try:
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                try:
+                    row = json.loads(body)
+                except ValueError:
+                    raise ValueError("Request body is not a JSON object.")
+                query = parse_manifest_row(row)
+            except ValueError as e:
+                return self.send_json(400, {'error': str(e)})
+            if not slots.acquire(blocking=False):
+                return self.send_json(503, {'error': "Too many QBRs in progress, retry later"}, {'Retry-After': str(SERVICE_RETRY_AFTER)})
+            with jobs_lock:
+                jobs[0] += 1
+            try:
+                output = executor.submit(run_service_job, query, history_db).result()
+            except Exception as e:
+                logging.error("QBR request failed: %s", e)
+                output = None
+            finally:
+                with jobs_lock:
+                    jobs[0] -= 1
+                slots.release()
+            if output is None:
+                return self.send_json(500, {'error': "QBR run failed, see the service log for details"})
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/zip')
+            self.send_header('Content-Disposition', 'attachment; filename="qbr_outputs.zip"')
+            self.send_header('Content-Length', str(len(output)))
+            self.end_headers()
+            self.wfile.write(output)
+
+        def send_json(self, status, body, headers=None):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            # Request lines only: tokens travel in the body and are never logged
+            logging.info("%s - %s", self.address_string(), format % args)
+
+    return http.server.ThreadingHTTPServer((host, port), QBRRequestHandler)
+
+def serve(host=SERVICE_HOST, port=SERVICE_PORT, workers=SERVICE_WORKERS, queue_size=SERVICE_QUEUE_SIZE, api_concurrency=BATCH_API_CONCURRENCY, history_db=HISTORY_DB, breakdowns=()):
+    # Long-running service: the worker processes start (and import everything) once, then
+    # every request only pays for its own data and rendering
+    api_slots = multiprocessing.BoundedSemaphore(api_concurrency)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_service_worker, initargs=(api_slots, breakdowns, CHART_CACHE_DIR, ZIP_COMPRESS_LEVEL)) as executor:
+        # Start every worker before serving, so no request waits for their imports
+        pids = {future.result() for future in [executor.submit(_service_worker_ready) for _ in range(workers)]}
+        server = create_service(executor, host, port, workers + queue_size, history_db)
+        logging.info(f"Serving QBRs on http://{host}:{server.server_address[1]}/qbr with {len(pids)} warm workers and room for {queue_size} queued requests")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            logging.info("Shutting down the QBR service")
+        finally:
+            server.server_close()
+
+# Command line functions
+STAGES = ('fetch', 'render', 'bundle', 'all', 'serve')
+
+def parse_breakdown(value):
+    # "country:installs" or "campaign,network:sessions"
+    match = re.match(r"^(\w+(?:,\w+)*):(\w+)$", value)
+    if not match:
+        raise argparse.ArgumentTypeError(f"invalid breakdown '{value}', expected DIMENSIONS:METRIC, e.g. country:installs")
+    if not report_metrics(match.group(2)):
+        raise argparse.ArgumentTypeError(f"invalid breakdown '{value}', {match.group(2)} is not computed from report metrics")
+    return match.group(1).split(','), match.group(2)
+
+def get_query(args):
+    # Take the query from the command line when any part of it is given, otherwise prompt for it
+    if not (args.api_token or args.utc_offset or args.date_range):
+        api_token, app_tokens = get_tokens()
+        if not api_token:
+            return None
         utc_offset = get_utc_offset()
-        if utc_offset:
-            start_date, end_date = get_date_period()
-            if start_date and end_date:
-                date_period = format_date_period(start_date, end_date)
-                if date_period:
-                    urls = []
-                    url1 = make_api_request(api_token, app_tokens, utc_offset, date_period, 'month', 'installs,reattributions,sessions,rejected_installs,rejected_reattributions,organic_install_rate,maus,clicks,impressions,events,revenue_events', 'data_by_month.csv')
-                    if url1:
-                        urls.append(url1)
-                    url2 = make_api_request(api_token, app_tokens, utc_offset, date_period, 'channel', 'installs,reattributions,sessions,rejected_installs,rejected_reattributions', 'data_by_channel.csv')
-                    if url2:
-                        urls.append(url2)
-                    try:
-                        plot_data()
-                        with open('audit_trail.csv', 'w', newline='') as csvfile:
-                            audit_writer = csv.writer(csvfile)
-                            audit_writer.writerow(['Request Header', 'Requested URL'])
-                            for url in urls:
-                                audit_writer.writerow(['API Token: Bearer ' + api_token, url])
-                        logging.info("Audit trail saved to 'audit_trail.csv'")
-                        # After all processing and plotting:
-                        files_to_zip = ['data_by_month.csv', 'data_by_channel.csv', 'audit_trail.csv', 'percent_installsxreattributions_by_month.png', 'absolute_installsxreattributions_by_month.png', 'absolute_paidinstallsxorganicinstalls_by_month.png', 'absolute_paidinstalls_by_month.png', 'top_installs_by_channel.png', 'top_sessions_by_channel.png', 'maus_by_month.png', 'absolute_rejected_attributions_by_month.png', 'top_rejected_attributions_by_channel.png', 'absolute_sessions_revevents_by_month.png', 'absolute_clicks_impressions_by_month.png']
-                        zip_outputs(files_to_zip, 'qbr_outputs.zip')
-                    except Exception as e:
-                            logging.error("Failed during zipping: %s", e)
+        if not utc_offset:
+            return None
+        start_date, end_date = get_date_period()
+        if not (start_date and end_date):
+            return None
+        return api_token, app_tokens, utc_offset, start_date, end_date
+    row = {'api_token': args.api_token, 'app_tokens': ' '.join(args.app_tokens or ['all']), 'utc_offset': args.utc_offset, 'date_range': args.date_range}
+    try:
+        return parse_manifest_row(row)
+    except ValueError as e:
+        logging.error("Invalid arguments: %s", e)
+        return None
+
+if __name__ == "__main__":
+    # Without a stage the whole pipeline runs as before, e.g. `python3 autoqbr.py --batch jobs.json`
+    argv = sys.argv[1:]
+    if not argv or argv[0] not in STAGES + ('-h', '--help'):
+        argv = ['all'] + argv
+    parser = argparse.ArgumentParser(description="Generate QBR charts and data bundles from Adjust reports.")
+    stages = parser.add_subparsers(dest='stage', required=True, metavar='{fetch,render,bundle,all,serve}')
+    workdir_options = argparse.ArgumentParser(add_help=False)
+    workdir_options.add_argument('--workdir', default='.', help="Directory the stages pass reports, audit trail and charts through (default: current directory)")
+    query_options = argparse.ArgumentParser(add_help=False)
+    query_options.add_argument('--api-token', help="API token (prompted for when no query option is given)")
+    query_options.add_argument('--app-tokens', nargs='+', metavar='APP_TOKEN', help="App tokens, or all (default: all)")
+    query_options.add_argument('--utc-offset', help="Timezone offset, e.g. +00:00")
+    query_options.add_argument('--date-range', metavar='YYYY-MM-DD/YYYY-MM-DD', help="Time range of the data")
+    query_options.add_argument('--no-history', action='store_true', help="Fetch the whole date range instead of only months missing from the history store")
+    render_options = argparse.ArgumentParser(add_help=False)
+    render_options.add_argument('--chart-workers', type=int, default=CHART_WORKERS, help="Processes rendering charts in parallel (default: %(default)s)")
+    render_options.add_argument('--no-chart-cache', action='store_true', help="Render every chart instead of copying unchanged ones from the chart cache")
+    bundle_options = argparse.ArgumentParser(add_help=False)
+    bundle_options.add_argument('--output', default='qbr_outputs.zip', help="ZIP archive to write (default: %(default)s)")
+    bundle_options.add_argument('--metrics', action='store_true', help="Also print the timing and memory of every step to stdout")
+    bundle_options.add_argument('--compress-level', type=int, choices=range(10), default=ZIP_COMPRESS_LEVEL, metavar='0-9',
+                                help="Deflate level of the CSVs in the ZIP, charts are stored as they are (default: %(default)s)")
+    workdir_options.add_argument('--profile', choices=['fetch', 'parse', 'render', 'audit', 'bundle'], help="Run this stage's steps under cProfile and save the stats as <stage>.prof in the workdir")
+    # Every stage needs the breakdowns: fetch requests their reports, render draws them and bundle zips them
+    breakdown_options = argparse.ArgumentParser(add_help=False)
+    breakdown_options.add_argument('--breakdown', action='append', type=parse_breakdown, default=[], metavar='DIMENSIONS:METRIC',
+                                   help="Add a top-N chart of METRIC by DIMENSIONS, e.g. country:installs or campaign,network:sessions (repeatable)")
+    breakdown_options.add_argument('--top-n', type=int, default=BREAKDOWN_TOP_N, help="Bars per added breakdown chart (default: %(default)s)")
+    breakdown_options.add_argument('--other', action='store_true', help="Roll everything outside the top N of added breakdowns up into an 'Other' bar")
+    stages.add_parser('fetch', parents=[workdir_options, breakdown_options, query_options], help="Fetch the reports and write the audit trail")
+    stages.add_parser('render', parents=[workdir_options, breakdown_options, render_options], help="Render the charts from fetched reports")
+    stages.add_parser('bundle', parents=[workdir_options, breakdown_options, bundle_options], help="Zip the reports, audit trail, charts and metrics")
+    all_stages = stages.add_parser('all', parents=[workdir_options, breakdown_options, query_options, render_options, bundle_options], help="Run every stage (default)")
+    all_stages.add_argument('--batch', metavar='MANIFEST', help="Run non-interactively for every job in a JSON/CSV manifest")
+    all_stages.add_argument('--output-dir', default='.', help="Directory for the batch ZIP archives (default: current directory)")
+    all_stages.add_argument('--workers', type=int, default=BATCH_WORKERS, help="Batch jobs run in parallel (default: %(default)s)")
+    all_stages.add_argument('--api-concurrency', type=int, default=BATCH_API_CONCURRENCY, help="Report requests in flight across all batch jobs (default: %(default)s)")
+    all_stages.add_argument('--in-memory', action='store_true', help="Keep reports and charts in memory and write them straight into the ZIP")
+    service = stages.add_parser('serve', parents=[breakdown_options], help="Serve QBRs over a local HTTP endpoint from warm worker processes")
+    service.add_argument('--host', default=SERVICE_HOST, help="Address to listen on (default: %(default)s)")
+    service.add_argument('--port', type=int, default=SERVICE_PORT, help="Port to listen on (default: %(default)s)")
+    service.add_argument('--workers', type=int, default=SERVICE_WORKERS, help="QBRs generated at once, one warm process each (default: %(default)s)")
+    service.add_argument('--queue-size', type=int, default=SERVICE_QUEUE_SIZE, help="QBR requests waiting for a worker before new ones get 503 (default: %(default)s)")
+    service.add_argument('--api-concurrency', type=int, default=BATCH_API_CONCURRENCY, help="Report requests in flight across all workers (default: %(default)s)")
+    service.add_argument('--no-history', action='store_true', help="Fetch the whole date range instead of only months missing from the history store")
+    service.add_argument('--no-chart-cache', action='store_true', help="Render every chart instead of copying unchanged ones from the chart cache")
+    service.add_argument('--compress-level', type=int, choices=range(10), default=ZIP_COMPRESS_LEVEL, metavar='0-9',
+                         help="Deflate level of the CSVs in the ZIP, charts are stored as they are (default: %(default)s)")
+    args = parser.parse_args(argv)
+    METRICS_STDOUT = getattr(args, 'metrics', False)
+    ZIP_COMPRESS_LEVEL = getattr(args, 'compress_level', ZIP_COMPRESS_LEVEL)
+    PROFILE_STAGE = getattr(args, 'profile', None)
+    if getattr(args, 'no_chart_cache', False):
+        CHART_CACHE_DIR = None
+    breakdowns = [dict(dimensions=dimensions, metric=metric, top_n=args.top_n, other=args.other) for dimensions, metric in args.breakdown]
+    for breakdown in breakdowns:
+        register_breakdown(**breakdown)
+    if args.stage == 'render':
+        raise SystemExit(0 if plot_data(args.workdir, args.chart_workers) else 1)
+    if args.stage == 'bundle':
+        raise SystemExit(0 if bundle_stage(args.workdir, args.output) else 1)
+    history_db = None if args.no_history else HISTORY_DB
+    if args.stage == 'serve':
+        serve(args.host, args.port, args.workers, args.queue_size, args.api_concurrency, history_db, breakdowns)
+        raise SystemExit(0)
+    if args.stage == 'all' and args.batch:
+        results = run_batch(args.batch, args.output_dir, args.workers, args.api_concurrency, args.in_memory, history_db, breakdowns)
+        raise SystemExit(0 if all(ok for _, ok, _ in results) else 1)
+    query = get_query(args)
+    if not query:
+        raise SystemExit(1)
+    if args.stage == 'fetch':
+        done = fetch_stage(*query, args.workdir, history_db)
+    elif args.in_memory:
+        done = run_qbr_in_memory(*query, args.output, args.chart_workers, history_db)
+    else:
+        done = run_qbr(*query, args.workdir, args.output, args.chart_workers, history_db)
+    raise SystemExit(0 if done else 1)
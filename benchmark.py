@@ -0,0 +1,187 @@
+# Offline benchmarks for autoqbr: a local stub of the report service, synthetic Adjust
+# reports and scenarios that time each stage (fetch, render, bundle) over row counts and
+# month spans, recording peak RSS.
+#
+#   python3 benchmark.py --rows 1000 100000 --months 3 12 --latency 0.05 --json results.json
+import argparse, csv, http.server, io, json, logging, multiprocessing, os, random, re, resource, shutil, subprocess, sys, tempfile, threading, time, urllib.parse
+from datetime import date, timedelta
+
+import autoqbr
+
+# Names used for rows of non-month dimensions; 'Organic' is always the first channel
+DIMENSION_VALUES = {'channel': ['Organic', 'Facebook', 'Google Ads', 'TikTok', 'Unity', 'Snap', 'Apple Search Ads']}
+RATE_RANGE = (0.05, 0.6)  # organic_install_rate is a share, every other metric a count
+
+# Synthetic report functions
+def dimension_values(dimension, count):
+    known = DIMENSION_VALUES.get(dimension, [])
+    return (known + [f"{dimension.title()} {i}" for i in range(len(known) + 1, count + 1)])[:max(count, 1)]
+
+def synthetic_report(dimensions, metrics, start_date, end_date, rows, seed=0):
+    # CSV bytes shaped like the report service's: a header of the requested dimensions and
+    # metrics, then `rows` rows. Month rows are spread over every month of the range (a
+    # month appears several times, like merged shards); other dimensions get `rows` values.
+    rng = random.Random(f"{seed}|{dimensions}|{start_date}|{end_date}")
+    dimensions, metrics = dimensions.split(','), metrics.split(',')
+    months = [start[:7] for start, _ in autoqbr.split_date_range(start_date, end_date)]
+    text = io.StringIO()
+    writer = csv.writer(text, lineterminator='\n')
+    writer.writerow(dimensions + metrics)
+    values = {dimension: months if dimension == 'month' else dimension_values(dimension, rows) for dimension in dimensions}
+    for i in range(rows):
+        row = [values[dimension][i % len(values[dimension])] for dimension in dimensions]
+        for metric in metrics:
+            if metric in autoqbr.RATE_METRICS:
+                row.append(f"{rng.uniform(*RATE_RANGE):.4f}")
+            else:
+                row.append(rng.randint(0, 100_000))
+        writer.writerow(row)
+    return text.getvalue().encode()
+
+def write_synthetic_reports(workdir, start_date, end_date, rows, seed=0):
+    # The reports a fetch stage would leave in workdir, for benchmarking render and bundle alone
+    for dimensions, metrics, filename in autoqbr.REPORTS:
+        with open(os.path.join(workdir, filename), 'wb') as file:
+            file.write(synthetic_report(dimensions, metrics, start_date, end_date, rows, seed))
+
+# Stub report service
+def parse_date_period(date_period):
+    # Inverse of autoqbr.format_date_period: "-Nd:-Md" days before today
+    start_days, end_days = re.match(r"^-(\d+)d:-(\d+)d$", date_period).groups()
+    today = date.today()
+    return (today - timedelta(days=int(start_days))).isoformat(), (today - timedelta(days=int(end_days))).isoformat()
+
+class StubReportService(http.server.ThreadingHTTPServer):
+    # Stands in for /control-center/reports-service/csv_report on localhost
+    daemon_threads = True
+
+    def __init__(self, latency=0.0, error_rate=0.0, error_status=503, rows=100, seed=0):
+        super().__init__(('127.0.0.1', 0), StubReportHandler)
+        self.latency, self.error_rate, self.error_status, self.rows = latency, error_rate, error_status, rows
+        self.random = random.Random(seed)
+        self.seed = seed
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/control-center/reports-service/csv_report"
+
+class StubReportHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Keep-alive, like the real service
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            failed = server.random.random() < server.error_rate
+        time.sleep(server.latency)
+        if failed:
+            self.send_response(server.error_status)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        query = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+        start_date, end_date = parse_date_period(query['date_period'][0])
+        body = synthetic_report(query['dimensions'][0], query['metrics'][0], start_date, end_date, server.rows, server.seed)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/csv')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def start_stub(**options):
+    # Serve in a background thread; call .shutdown() when done
+    server = StubReportService(**options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+# Scenario functions
+def date_range_for(months):
+    # The last `months` closed calendar months
+    end = date.today().replace(day=1) - timedelta(days=1)
+    start = end.replace(day=1)
+    for _ in range(months - 1):
+        start = (start - timedelta(days=1)).replace(day=1)
+    return start.isoformat(), end.isoformat()
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+def timed(stage, function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return {'stage': stage, 'seconds': round(time.perf_counter() - start, 4), 'peak_rss_mb': round(peak_rss_mb(), 1)}, result
+
+def run_scenario(rows, months, latency, error_rate, chart_workers, seed):
+    # One QBR against the stub: fetch over HTTP, render and bundle, timing each stage.
+    # Runs in a fresh process, so peak RSS only covers this scenario.
+    logging.disable(logging.INFO)
+    server = start_stub(latency=latency, error_rate=error_rate, rows=rows, seed=seed)
+    autoqbr.API_BASE_URL = server.url
+    # Seeded data would otherwise hit the chart cache on repeats, and the user's cache stays untouched
+    autoqbr.CHART_CACHE_DIR = None
+    workdir = tempfile.mkdtemp(prefix='autoqbr-bench-')
+    try:
+        start_date, end_date = date_range_for(months)
+        # No report cache and no history store: every run measures real requests
+        fetch, results = timed('fetch', autoqbr.fetch_reports, 'bench-token', None, '+00:00', start_date, end_date, autoqbr.REPORTS, None, None, workdir)
+        if not all(results):
+            raise RuntimeError("fetch failed against the stub")
+        autoqbr.write_audit_trail('bench-token', [url for urls in results for url in urls], os.path.join(workdir, 'audit_trail.csv'))
+        render, charts = timed('render', autoqbr.plot_data, workdir, chart_workers)
+        bundle, _ = timed('bundle', autoqbr.bundle_stage, workdir, os.path.join(workdir, 'qbr_outputs.zip'))
+        bundle['zip_bytes'] = os.path.getsize(os.path.join(workdir, 'qbr_outputs.zip'))
+        fetch['requests'] = server.requests
+        render['charts'] = len(charts)
+        return [fetch, render, bundle]
+    finally:
+        server.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def run_import_scenario(repeat=3):
+    # Cold import of autoqbr in a fresh interpreter, best of `repeat`
+    probe = "import time; start = time.perf_counter(); import autoqbr; print(time.perf_counter() - start)"
+    here = os.path.dirname(os.path.abspath(__file__))
+    seconds = min(float(subprocess.run([sys.executable, '-c', probe], cwd=here, capture_output=True, text=True, check=True).stdout.split()[-1])
+                  for _ in range(repeat))
+    return {'stage': 'import', 'seconds': round(seconds, 4)}
+
+def run_benchmarks(rows_list, months_list, latency=0.0, error_rate=0.0, chart_workers=1, repeat=1, seed=0):
+    results = [dict(run_import_scenario(), rows=None, months=None, run=1)]
+    context = multiprocessing.get_context('spawn')
+    for rows in rows_list:
+        for months in months_list:
+            for run in range(1, repeat + 1):
+                with context.Pool(1) as pool:
+                    stages = pool.apply(run_scenario, (rows, months, latency, error_rate, chart_workers, seed))
+                results.extend(dict(stage, rows=rows, months=months, run=run) for stage in stages)
+                print(format_row(results[-3:]), flush=True)
+    return results
+
+def format_row(stages):
+    rows, months = stages[0]['rows'], stages[0]['months']
+    timings = '  '.join(f"{stage['stage']} {stage['seconds']:7.3f}s" for stage in stages)
+    return f"rows={rows:<8} months={months:<3} {timings}  peak RSS {max(stage['peak_rss_mb'] for stage in stages):.1f} MB"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark autoqbr stages against a local stub of the report service.")
+    parser.add_argument('--rows', type=int, nargs='+', default=[1_000, 10_000, 100_000], help="Rows per report response (default: %(default)s)")
+    parser.add_argument('--months', type=int, nargs='+', default=[3, 12], help="Months covered by the date range (default: %(default)s)")
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds the stub waits before answering (default: %(default)s)")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Share of requests the stub answers with 503 (default: %(default)s)")
+    parser.add_argument('--chart-workers', type=int, default=1, help="Processes rendering charts (default: %(default)s, in-process so RSS covers rendering)")
+    parser.add_argument('--repeat', type=int, default=1, help="Runs per scenario (default: %(default)s)")
+    parser.add_argument('--seed', type=int, default=0, help="Seed for the synthetic data and injected errors (default: %(default)s)")
+    parser.add_argument('--json', metavar='PATH', help="Also write every measurement to this JSON file")
+    args = parser.parse_args()
+    results = run_benchmarks(args.rows, args.months, args.latency, args.error_rate, args.chart_workers, args.repeat, args.seed)
+    print(f"import autoqbr: {results[0]['seconds']:.3f}s")
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(results, file, indent=2)
@@ -0,0 +1,25 @@
+import csv, io, os
+
+import autoqbr
+import benchmark
+
+def test_synthetic_reports_have_the_requested_columns():
+    for dimensions, metrics, _ in autoqbr.REPORTS:
+        rows = list(csv.reader(io.StringIO(benchmark.synthetic_report(dimensions, metrics, '2024-01-01', '2024-03-31', 30).decode())))
+        assert rows[0] == dimensions.split(',') + metrics.split(',')
+        assert len(rows) == 31
+    months = {row['month'] for row in csv.DictReader(io.StringIO(benchmark.synthetic_report('month', 'installs', '2024-01-01', '2024-03-31', 30).decode()))}
+    assert months == {'2024-01', '2024-02', '2024-03'}
+
+def test_fetch_against_stub(tmp_path, monkeypatch):
+    server = benchmark.start_stub(rows=20)
+    try:
+        monkeypatch.setattr(autoqbr, 'API_BASE_URL', server.url)
+        start_date, end_date = benchmark.date_range_for(2)
+        results = autoqbr.fetch_reports('token', None, '+00:00', start_date, end_date, cache_dir=None, workdir=str(tmp_path))
+        assert all(results)
+        assert server.requests == len(autoqbr.REPORTS)
+        for _, _, filename in autoqbr.REPORTS:
+            assert os.path.getsize(tmp_path / filename) > 0
+    finally:
+        server.shutdown()
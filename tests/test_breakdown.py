@@ -0,0 +1,64 @@
+import argparse
+import io
+
+import pytest
+
+import autoqbr
+
+REPORT = b"""country,channel,installs
+US,Organic,900
+US,Facebook,50
+DE,Facebook,40
+DE,Google Ads,70
+FR,Organic,30
+FR,TikTok,10
+US,Facebook,25
+"""
+
+@pytest.fixture(autouse=True)
+def registries(monkeypatch):
+    # Breakdowns registered here must not leak into the module's reports and charts
+    monkeypatch.setattr(autoqbr, 'REPORTS', list(autoqbr.REPORTS))
+    monkeypatch.setattr(autoqbr, 'CHARTS', dict(autoqbr.CHARTS))
+    for metric in autoqbr.DERIVED_METRICS.values():
+        monkeypatch.setitem(metric, 'sources', list(metric['sources']))
+
+def load(dimensions):
+    return autoqbr.add_derived_metrics(autoqbr.load_report(io.BytesIO(REPORT), dimensions), dimensions)
+
+def test_top_excludes_organic_and_sums_duplicates():
+    top = autoqbr.top_breakdown(load('channel'), ['channel'], 'installs', top_n=2)
+    assert top['label'].tolist() == ['Facebook', 'Google Ads']
+    assert top['installs'].tolist() == [115, 70]
+
+def test_other_rolls_up_the_tail():
+    top = autoqbr.top_breakdown(load('channel'), ['channel'], 'installs', top_n=1, other=True)
+    assert top['label'].tolist() == ['Facebook', autoqbr.OTHER_LABEL]
+    assert top['installs'].tolist() == [115, 80]
+
+def test_multiple_dimensions():
+    autoqbr.register_breakdown(['country', 'channel'], 'installs')
+    top = autoqbr.top_breakdown(load('country,channel'), ['country', 'channel'], 'installs', top_n=2)
+    assert top['label'].tolist() == ['US / Facebook', 'DE / Google Ads']
+    assert ('country,channel', 'installs', 'data_by_country_channel.csv') in autoqbr.REPORTS
+
+def test_breakdown_without_traffic_source_keeps_organic():
+    filename = autoqbr.register_breakdown(['country'], 'installs')
+    assert not autoqbr.CHARTS[filename]['exclude_organic']
+    top = autoqbr.top_breakdown(load('country'), ['country'], 'installs', top_n=1, exclude_organic=False)
+    assert top['label'].tolist() == ['US']
+
+def test_derived_metric_requests_its_inputs():
+    filename = autoqbr.register_breakdown(['country'], 'rejected_attributions')
+    assert ('country', 'rejected_installs,rejected_reattributions', 'data_by_country.csv') in autoqbr.REPORTS
+    report = b"country,rejected_installs,rejected_reattributions\nUS,3,1\nDE,5,4\nFR,1,0\n"
+    data = autoqbr.add_derived_metrics(autoqbr.load_report(io.BytesIO(report), 'country'), 'country')
+    top = autoqbr.chart_input(autoqbr.CHARTS[filename], {'country': data})
+    assert top['label'].tolist() == ['DE', 'US', 'FR']
+    assert top['rejected_attributions'].tolist() == [9, 4, 1]
+
+def test_metric_without_report_inputs_is_rejected():
+    with pytest.raises(ValueError):
+        autoqbr.register_breakdown(['country'], 'is_organic')
+    with pytest.raises(argparse.ArgumentTypeError):
+        autoqbr.parse_breakdown('country:is_organic')
@@ -0,0 +1,28 @@
+import io
+import zipfile
+
+import autoqbr
+
+def test_charts_are_stored_and_text_deflated(tmp_path):
+    report = tmp_path / 'data_by_month.csv'
+    report.write_text('month,installs\n' + '2025-01,100\n' * 100)
+    output = io.BytesIO()
+    with autoqbr.open_bundle(output, compress_level=9) as add:
+        add(str(report), remove=True)
+        add('chart.png', b'\x89PNG' + bytes(1000))
+    with zipfile.ZipFile(output) as zipf:
+        members = zipf.infolist()
+        assert [member.filename for member in members] == ['data_by_month.csv', 'chart.png']
+        assert members[0].compress_type == zipfile.ZIP_DEFLATED
+        assert members[0].compress_size < members[0].file_size
+        assert members[1].compress_type == zipfile.ZIP_STORED
+        assert zipf.read('data_by_month.csv').decode().count('2025-01') == 100
+    assert not report.exists()
+
+def test_missing_file_is_skipped(tmp_path):
+    output = tmp_path / 'qbr_outputs.zip'
+    with autoqbr.open_bundle(str(output)) as add:
+        add(str(tmp_path / 'missing.csv'))
+        add('audit_trail.csv', b'App Token,URLs\n')
+    with zipfile.ZipFile(output) as zipf:
+        assert zipf.namelist() == ['audit_trail.csv']
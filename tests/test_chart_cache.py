@@ -0,0 +1,53 @@
+import io
+
+import pytest
+
+import autoqbr
+
+REPORT = b"""channel,installs
+Organic,900
+Facebook,50
+Google Ads,70
+TikTok,10
+"""
+
+@pytest.fixture(autouse=True)
+def one_chart(monkeypatch, tmp_path):
+    # A single top-N chart and a private chart cache, so runs are quick and isolated
+    monkeypatch.setattr(autoqbr, 'REPORTS', [])
+    monkeypatch.setattr(autoqbr, 'CHARTS', {})
+    monkeypatch.setattr(autoqbr, 'CHART_CACHE_DIR', str(tmp_path / 'charts'))
+    autoqbr.register_breakdown(['channel'], 'installs')
+
+def frames(report=REPORT):
+    return {'channel': autoqbr.add_derived_metrics(autoqbr.load_report(io.BytesIO(report), 'channel'), 'channel')}
+
+def test_unchanged_chart_is_copied_from_cache(monkeypatch, tmp_path):
+    first = autoqbr.render_charts(frames(), None, workers=1)
+    def fail(*args):
+        raise AssertionError("chart rendered again")
+    monkeypatch.setattr(autoqbr, 'render_chart', fail)
+    (tmp_path / 'out').mkdir()
+    second = autoqbr.render_charts(frames(), str(tmp_path / 'out'), workers=1)
+    assert list(second) == list(first)
+    with open(second['top_installs_by_channel.png'], 'rb') as file:
+        assert file.read() == first['top_installs_by_channel.png']
+
+def test_changed_data_renders_again(monkeypatch):
+    autoqbr.render_charts(frames(), None, workers=1)
+    rendered = []
+    render_chart = autoqbr.render_chart
+    def counting(name, data, path=None):
+        rendered.append(name)
+        return render_chart(name, data, path)
+    monkeypatch.setattr(autoqbr, 'render_chart', counting)
+    autoqbr.render_charts(frames(REPORT.replace(b'70', b'71')), None, workers=1)
+    assert rendered == ['top_installs_by_channel.png']
+
+def test_failed_chart_is_not_cached(monkeypatch, tmp_path, caplog):
+    def fail(*args):
+        raise RuntimeError("no chart")
+    monkeypatch.setattr(autoqbr, 'render_chart', fail)
+    assert autoqbr.render_charts(frames(), None, workers=1) == {}
+    assert not (tmp_path / 'charts').exists()
+    assert "chart cache" not in caplog.text
@@ -0,0 +1,14 @@
+from datetime import datetime, timezone
+
+import autoqbr
+
+def test_month_is_open_until_it_ends_in_the_report_timezone():
+    # 02:00 UTC on Feb 1 is still January 31 at -08:00
+    now = datetime(2025, 2, 1, 2, tzinfo=timezone.utc)
+    assert not autoqbr.is_settled_period('2025-01-31', '-08:00', now)
+
+def test_month_settles_a_few_days_after_it_ends():
+    settle_days = autoqbr.HISTORY_SETTLE_DAYS
+    assert not autoqbr.is_settled_period('2025-01-31', '+00:00', datetime(2025, 2, settle_days, 12, tzinfo=timezone.utc))
+    assert autoqbr.is_settled_period('2025-01-31', '+00:00', datetime(2025, 2, settle_days + 1, 12, tzinfo=timezone.utc))
+    assert not autoqbr.is_settled_period('2025-01-31', '-08:00', datetime(2025, 2, settle_days + 1, 2, tzinfo=timezone.utc))
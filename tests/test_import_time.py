@@ -0,0 +1,29 @@
+import os, subprocess, sys, json
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Importing autoqbr (what every stage pays before doing any work) has to stay well below
+# the cost of the plotting stack, which takes seconds on a cold start
+IMPORT_BUDGET = 0.5  # Seconds
+HEAVY_MODULES = ['pandas', 'numpy', 'matplotlib', 'seaborn', 'requests']
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import autoqbr
+elapsed = time.perf_counter() - start
+print(json.dumps({'elapsed': elapsed, 'loaded': [name for name in %r if name in sys.modules]}))
+""" % HEAVY_MODULES
+
+def probe_import():
+    # A fresh interpreter each time, so nothing is already imported by pytest
+    output = subprocess.run([sys.executable, '-c', PROBE], cwd=ROOT, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+def test_import_skips_heavy_modules():
+    assert probe_import()['loaded'] == []
+
+def test_import_time_budget():
+    # Best of a few runs, so a busy machine doesn't fail the budget
+    elapsed = min(probe_import()['elapsed'] for _ in range(3))
+    assert elapsed < IMPORT_BUDGET, f"importing autoqbr took {elapsed:.3f}s, budget is {IMPORT_BUDGET}s"
@@ -0,0 +1,23 @@
+import autoqbr
+
+def write(path, text):
+    path.write_bytes(text.encode())
+    return str(path)
+
+def test_parts_share_one_header(tmp_path):
+    parts = [write(tmp_path / 'a.csv', 'month,installs\n2025-01,1\n'),
+             write(tmp_path / 'b.csv', 'month,installs\n'),  # A month without data
+             write(tmp_path / 'c.csv', 'month,installs\n2025-03,3')]  # No trailing newline
+    autoqbr.merge_report_files(parts, str(tmp_path / 'report.csv'))
+    assert (tmp_path / 'report.csv').read_text() == 'month,installs\n2025-01,1\n2025-03,3\n'
+
+def test_parts_with_other_columns_are_aligned(tmp_path):
+    parts = [write(tmp_path / 'a.csv', 'channel,installs\nFacebook,1\n'),
+             write(tmp_path / 'b.csv', 'channel,installs,sessions\nTikTok,2,5\n')]
+    autoqbr.merge_report_files(parts, str(tmp_path / 'report.csv'))
+    assert (tmp_path / 'report.csv').read_text() == 'channel,installs,sessions\nFacebook,1,\nTikTok,2,5\n'
+
+def test_report_without_rows_keeps_its_header(tmp_path):
+    parts = [write(tmp_path / 'a.csv', 'month,installs\n'), write(tmp_path / 'b.csv', 'month,installs\n')]
+    autoqbr.merge_report_files(parts, str(tmp_path / 'report.csv'))
+    assert (tmp_path / 'report.csv').read_text() == 'month,installs\n'
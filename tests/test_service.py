@@ -0,0 +1,56 @@
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import autoqbr
+
+QUERY = {'api_token': 'T', 'app_tokens': 'abc123', 'utc_offset': '+00:00', 'date_range': '2025-01-01/2025-03-31'}
+
+@pytest.fixture
+def service(monkeypatch):
+    # The HTTP front with one thread worker and no queue; jobs wait until `release` is set
+    release = threading.Event()
+    def run_service_job(query, history_db):
+        release.wait(5)
+        return b'PK zip of ' + ' '.join(query[1]).encode()
+    monkeypatch.setattr(autoqbr, 'run_service_job', run_service_job)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        server = autoqbr.create_service(executor, port=0, capacity=1)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        yield f"http://127.0.0.1:{server.server_address[1]}", release
+        release.set()
+        server.shutdown()
+        server.server_close()
+
+def post(url, body):
+    request = urllib.request.Request(f"{url}/qbr", data=json.dumps(body).encode(), method='POST')
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read()
+
+def test_returns_the_zip(service):
+    url, release = service
+    release.set()
+    assert post(url, QUERY) == (200, b'PK zip of abc123')
+
+def test_rejects_invalid_parameters(service):
+    url, _ = service
+    status, body = post(url, dict(QUERY, utc_offset='+0'))
+    assert status == 400
+    assert json.loads(body) == {'error': "Invalid UTC offset format."}
+
+def test_turns_away_requests_beyond_capacity(service):
+    url, release = service
+    first = ThreadPoolExecutor(max_workers=1).submit(post, url, QUERY)
+    while json.loads(urllib.request.urlopen(f"{url}/health").read())['jobs'] == 0:
+        time.sleep(0.01)
+    assert post(url, QUERY)[0] == 503
+    release.set()
+    assert first.result()[0] == 200